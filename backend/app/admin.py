@@ -2,79 +2,132 @@
 Admin endpoints for data management, user management, and analytics
 """
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
-from typing import List
+from fastapi.responses import FileResponse
+from typing import List, Optional
 from sqlalchemy.orm import Session
 from app.auth import get_current_user
 from app.models import User
 from app.database import get_db
-import threading
-import time
-import pandas as pd
-from app.elasticsearch_client import bulk_index_data
+import hashlib
+import os
+from app.config import settings
+from app.bulk import OP_TYPES
+from app.jobs import (
+    cancel_job, create_job, get_job, job_status, list_jobs, new_job_id, pause_job, result_path, resume_job, submit_job,
+)
 
-jobs = {}
+# Plans allowed to run enrichment jobs besides admins
+ENRICH_PLANS = ["investigator", "enterprise_basic", "enterprise_unlimited"]
 
 router = APIRouter()
 
 
+async def spool_upload(file: UploadFile, job_id: str, chunk_size: int = 1024 * 1024, max_bytes: int = None):
+    """Copy an upload to UPLOAD_DIR in chunks; returns (path, sha256 checksum)."""
+    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    suffix = os.path.splitext(file.filename or "")[1]
+    path = os.path.join(settings.UPLOAD_DIR, f"{job_id}{suffix}")
+    digest = hashlib.sha256()
+    with open(path, "wb") as out:
+        while True:
+            chunk = await file.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+            if max_bytes is not None and out.tell() > max_bytes:
+                break
+    if max_bytes is not None and os.path.getsize(path) > max_bytes:
+        os.remove(path)
+        raise HTTPException(status_code=413, detail=f"File too large, at most {max_bytes} bytes are allowed")
+    return path, digest.hexdigest()
+
+
 @router.post("/upload-data")
 async def upload_data(
     file: UploadFile = File(...),
+    op_type: Optional[str] = None,
+    bulk_mode: bool = False,
+    force_merge: bool = False,
+    priority: int = 0,
+    manifest: Optional[str] = None,
+    delete_missing: bool = False,
     current_user: User = Depends(get_current_user)
 ):
-    """Upload Excel/CSV file or JSON data to Elasticsearch."""
+    """
+    Upload a CSV/NDJSON (optionally gzip/zstd), Excel, Parquet or Arrow file to Elasticsearch.
+    op_type (create, index or update; default BULK_OP_TYPE) decides what happens to rows already indexed.
+    bulk_mode disables refresh and replicas while the job runs (searches won't see new rows until
+    it ends); force_merge then merges the index segments.
+    The job waits in the queue until a worker is free; higher priority jobs go first.
+    manifest names the data feed the file is a dump of: only rows new or changed since its last
+    import are indexed, and delete_missing deletes the documents that are no longer in it.
+    """
     # Check if user is admin
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Admin access required")
+    if op_type is not None and op_type not in OP_TYPES:
+        raise HTTPException(status_code=400, detail=f"op_type must be one of: {', '.join(OP_TYPES)}")
+    if delete_missing and not manifest:
+        raise HTTPException(status_code=400, detail="delete_missing needs a manifest")
+
+    # Spool to disk in chunks; the request never holds the whole file in memory
+    job_id = new_job_id()
+    path, checksum = await spool_upload(file, job_id)
+    options = {
+        "op_type": op_type, "bulk_mode": bulk_mode, "force_merge": force_merge,
+        "manifest": manifest, "delete_missing": delete_missing,
+    }
+    create_job(job_id, "upload", current_user.id, file.filename, path, checksum, options, priority)
+    # Run on the app's event loop so the job shares the pooled async ES client
+    submit_job(job_id, priority)
+    return {"job_id": job_id}
+
+
+@router.post("/enrich")
+async def enrich_identifiers(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Match a CSV of identifiers (a `value` column, optional `type`) against the index.
+    Matches are written to an NDJSON result file in the /api/search response shape;
+    follow progress with /upload-status and fetch the file from /enrich/{job_id}/download.
+    Every identifier costs one search credit, as in /api/search/batch; the job stops
+    when the credits run out.
+    """
+    if not (current_user.is_admin or current_user.plan_type in ENRICH_PLANS):
+        raise HTTPException(status_code=403, detail="Investigator plan or admin access required")
+    if not current_user.is_verified:
+        raise HTTPException(status_code=403, detail="Please verify your email before searching")
+    if current_user.searches_remaining < 1:
+        raise HTTPException(status_code=403, detail="Search limit reached. Please upgrade your plan.")
 
-    content = await file.read()
-    job_id = f"job_{int(time.time()*1000)}"
-    jobs[job_id] = {"status": "running", "processed": 0, "total": 0}
-
-    def worker():
-        try:
-            from io import BytesIO
-            df = pd.read_excel(BytesIO(content)) if file.filename.lower().endswith(('.xlsx', '.xls')) else pd.read_csv(BytesIO(content))
-            required = ['type', 'value']
-            for col in required:
-                if col not in df.columns:
-                    jobs[job_id] = {"status": "failed", "error": f"Missing column: {col}"}
-                    return
-            total = len(df)
-            jobs[job_id]["total"] = total
-            batch = []
-            for idx, row in df.iterrows():
-                doc = {
-                    "type": str(row['type']).lower(),
-                    "value": str(row['value']),
-                    "source": str(row.get('source', '')),
-                    "additional_info": str(row.get('additional_info', '')),
-                }
-                batch.append(doc)
-                if len(batch) >= 1000:
-                    # index chunk
-                    try:
-                        import asyncio
-                        asyncio.run(bulk_index_data(batch))
-                    except Exception:
-                        pass
-                    jobs[job_id]["processed"] += len(batch)
-                    batch = []
-            if batch:
-                try:
-                    import asyncio
-                    asyncio.run(bulk_index_data(batch))
-                except Exception:
-                    pass
-                jobs[job_id]["processed"] += len(batch)
-            jobs[job_id]["status"] = "completed"
-        except Exception as e:
-            jobs[job_id] = {"status": "failed", "error": str(e)}
-
-    threading.Thread(target=worker, daemon=True).start()
+    job_id = new_job_id()
+    path, checksum = await spool_upload(file, job_id, max_bytes=settings.ENRICH_MAX_BYTES)
+    create_job(job_id, "enrich", current_user.id, file.filename, path, checksum)
+    submit_job(job_id)
     return {"job_id": job_id}
 
 
+@router.get("/enrich/{job_id}/download")
+async def download_enrichment(job_id: str, current_user: User = Depends(get_current_user)):
+    """Download the NDJSON matches of a completed enrichment job."""
+    job = get_job(job_id)
+    if not job or job.kind != "enrich":
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not (current_user.is_admin or job.owner_id == current_user.id):
+        raise HTTPException(status_code=403, detail="Not allowed to access this job")
+    # A job stopped by the search limit keeps the matches found until then
+    if job.status != "completed" and not (job.status == "failed" and job.matched):
+        raise HTTPException(status_code=409, detail="Job has not completed")
+    return FileResponse(
+        result_path(job_id),
+        media_type="application/x-ndjson",
+        filename=f"{job_id}.ndjson"
+    )
+
+
 @router.get("/users")
 async def list_users(
     current_user: User = Depends(get_current_user),
@@ -244,8 +297,58 @@ async def get_analytics(
 
 @router.get("/upload-status")
 async def upload_status(job_id: str, current_user: User = Depends(get_current_user)):
-    if not current_user.is_admin:
+    job = get_job(job_id)
+    if job is None:
+        if not current_user.is_admin:
+            raise HTTPException(status_code=403, detail="Admin access required")
+        raise HTTPException(status_code=404, detail="Job not found")
+    # Enrichment jobs are visible to the investigator who started them
+    if not (current_user.is_admin or job.owner_id == current_user.id):
         raise HTTPException(status_code=403, detail="Admin access required")
-    if job_id not in jobs:
+    return job_status(job)
+
+
+def get_owned_job(job_id: str, current_user: User):
+    job = get_job(job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
-    return jobs[job_id]
+    if not (current_user.is_admin or job.owner_id == current_user.id):
+        raise HTTPException(status_code=403, detail="Not allowed to access this job")
+    return job
+
+
+@router.get("/jobs")
+async def jobs(status: Optional[str] = None, limit: int = 50, current_user: User = Depends(get_current_user)):
+    """Most recent upload and enrichment jobs, optionally filtered by status."""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return {"jobs": [dict(job_status(job), job_id=job.id) for job in list_jobs(status, min(limit, 500))]}
+
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel(job_id: str, current_user: User = Depends(get_current_user)):
+    """Cancel a queued, paused or running job; a running job stops at its next checkpoint."""
+    get_owned_job(job_id, current_user)
+    status = cancel_job(job_id)
+    if status is None:
+        raise HTTPException(status_code=409, detail="Job has already ended")
+    return {"job_id": job_id, "status": status}
+
+
+@router.post("/jobs/{job_id}/pause")
+async def pause(job_id: str, current_user: User = Depends(get_current_user)):
+    """Pause a queued or running job; a running job stops at its next checkpoint."""
+    get_owned_job(job_id, current_user)
+    status = pause_job(job_id)
+    if status is None:
+        raise HTTPException(status_code=409, detail="Only queued or running jobs can be paused")
+    return {"job_id": job_id, "status": status}
+
+
+@router.post("/jobs/{job_id}/resume")
+async def resume(job_id: str, current_user: User = Depends(get_current_user)):
+    """Queue a paused job again; it continues from its last checkpoint."""
+    get_owned_job(job_id, current_user)
+    if not resume_job(job_id):
+        raise HTTPException(status_code=409, detail="Job is not paused")
+    return {"job_id": job_id, "status": "queued"}
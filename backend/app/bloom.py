@@ -0,0 +1,294 @@
+"""
+Per-type Bloom filters over normalized identifier values.
+
+A filter that says "absent" is never wrong, so exact-identifier searches it
+rejects can return no results without touching the index. Filters are only
+consulted once a full rebuild (scripts/rebuild_bloom.py) has marked them
+complete; bulk indexing keeps them up to date after that.
+
+Filters are persisted under BLOOM_DIR. Saving ORs the bits already on disk
+into the in-memory filter first, holding a lock file so concurrent saves take
+turns, so the API and import processes can all add values without losing
+each other's updates.
+
+Values added by another process only become visible when it saves, once its
+bulk loads are done. Meanwhile the loading process keeps a writer-* marker file
+in BLOOM_DIR fresh, and other processes reject nothing while one is.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: saves are not serialized across processes
+    fcntl = None
+
+from app.config import settings
+from app.normalizers import DATA_TYPES
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, fp_rate: float, num_bits: int = None, num_hashes: int = None):
+        self.num_bits = num_bits or max(8, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.num_hashes = num_hashes or max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, value: str):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+    def estimated_fp_rate(self) -> float:
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+
+class BloomIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self.complete = False
+        self.filters = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._loaded_mtime = None
+        self._last_reload_check = 0.0
+        self._own_writers = set()
+        self._writers = 0  # loads in progress in this process
+        self._marker = None
+        self._marker_heartbeat = None
+        self._writers_active = False
+        self._rebuilding = False
+        self.load()
+
+    def _new_filter(self) -> BloomFilter:
+        return BloomFilter(settings.BLOOM_CAPACITY, settings.BLOOM_FP_RATE)
+
+    def _counters(self, data_type: str) -> dict:
+        return self.counters.setdefault(data_type, {"checks": 0, "rejected": 0, "false_positives": 0})
+
+    @property
+    def _meta_path(self):
+        return os.path.join(self.path, "bloom_meta.json")
+
+    def _read_disk(self):
+        """(meta, {type: BloomFilter}) as saved on disk, or (None, {})."""
+        if not os.path.exists(self._meta_path):
+            return None, {}
+        with open(self._meta_path) as f:
+            meta = json.load(f)
+        filters = {}
+        for data_type, info in meta["filters"].items():
+            bloom = BloomFilter(settings.BLOOM_CAPACITY, settings.BLOOM_FP_RATE, info["bits"], info["hashes"])
+            bloom.bits = np.fromfile(os.path.join(self.path, f"{data_type}.bits"), dtype=np.uint8)
+            bloom.count = info["count"]
+            filters[data_type] = bloom
+        return meta, filters
+
+    def _merge(self, filters: dict):
+        for data_type, disk in filters.items():
+            mine = self.filters.get(data_type)
+            if mine is None:
+                self.filters[data_type] = disk
+            elif mine.num_bits != disk.num_bits or mine.num_hashes != disk.num_hashes:
+                # A rebuild may resize the filters; otherwise the saved ones are newer
+                if not self._rebuilding:
+                    self.filters[data_type] = disk
+            else:
+                np.bitwise_or(mine.bits, disk.bits, out=mine.bits)
+                mine.count = max(mine.count, disk.count)
+
+    def load(self):
+        with self._lock:
+            try:
+                meta, filters = self._read_disk()
+            except Exception as e:
+                logger.warning(f"Could not load Bloom filters: {e}")
+                return
+            if meta is None:
+                return
+            self._merge(filters)
+            self.complete = self.complete or meta.get("complete", False)
+            self._loaded_mtime = os.path.getmtime(self._meta_path)
+
+    def _other_writers_active(self) -> bool:
+        """Whether another process is adding values it has not saved yet."""
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return False
+        now = time.time()
+        for name in names:
+            if not name.startswith("writer-") or name in self._own_writers:
+                continue
+            try:
+                # A marker nobody touched for a while was left by a crashed process
+                if now - os.path.getmtime(os.path.join(self.path, name)) < settings.BLOOM_WRITER_TIMEOUT:
+                    return True
+            except FileNotFoundError:
+                continue
+        return False
+
+    def maybe_reload(self):
+        """Pick up filters saved by another process, at most every few seconds."""
+        now = time.monotonic()
+        if now - self._last_reload_check < 5:
+            return
+        self._last_reload_check = now
+        # Writers save before dropping their marker, so look at the markers first
+        self._writers_active = self._other_writers_active()
+        if os.path.exists(self._meta_path) and os.path.getmtime(self._meta_path) != self._loaded_mtime:
+            self.load()
+
+    def save(self, merge: bool = True):
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            with open(os.path.join(self.path, "bloom.lock"), "w") as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                self._save(merge)
+
+    def _save(self, merge: bool):
+        if merge:
+            meta, filters = self._read_disk()
+            self._merge(filters)
+            self.complete = self.complete or bool(meta and meta.get("complete"))
+        meta = {"complete": self.complete, "filters": {}}
+        for data_type, bloom in self.filters.items():
+            tmp_path = os.path.join(self.path, f"{data_type}.bits.tmp")
+            bloom.bits.tofile(tmp_path)
+            os.replace(tmp_path, os.path.join(self.path, f"{data_type}.bits"))
+            meta["filters"][data_type] = {"bits": bloom.num_bits, "hashes": bloom.num_hashes, "count": bloom.count}
+        tmp_path = f"{self._meta_path}.tmp"
+        with open(tmp_path, "w") as out:
+            json.dump(meta, out)
+        os.replace(tmp_path, self._meta_path)
+        self._loaded_mtime = os.path.getmtime(self._meta_path)
+        self._rebuilding = False
+
+    async def _keep_fresh(self, marker: str):
+        while True:
+            await asyncio.sleep(max(1.0, settings.BLOOM_WRITER_TIMEOUT / 4))
+            os.utime(marker)
+
+    @asynccontextmanager
+    async def writing(self):
+        """
+        Hold a writer marker while values are added, then save them. Other processes
+        stop rejecting values until the marker is gone, as theirs would be stale.
+        Nested and concurrent loads in this process share one marker and one save.
+        """
+        if self._writers == 0:
+            name = f"writer-{uuid.uuid4().hex}"
+            os.makedirs(self.path, exist_ok=True)
+            open(os.path.join(self.path, name), "w").close()
+            self._own_writers.add(name)
+            self._marker = name
+            self._marker_heartbeat = asyncio.ensure_future(self._keep_fresh(os.path.join(self.path, name)))
+        self._writers += 1
+        try:
+            yield
+        finally:
+            self._writers -= 1
+            if self._writers == 0:
+                # A load starting during the save gets a marker of its own
+                name, self._marker = self._marker, None
+                self._marker_heartbeat.cancel()
+                try:
+                    await asyncio.to_thread(self.save)
+                finally:
+                    os.remove(os.path.join(self.path, name))
+                    self._own_writers.discard(name)
+
+    def add(self, data_type: str, value_norm: str):
+        if data_type not in DATA_TYPES:
+            return
+        bloom = self.filters.get(data_type)
+        if bloom is None:
+            bloom = self.filters[data_type] = self._new_filter()
+        bloom.add(value_norm)
+
+    def check(self, data_type: str, value_norm: str) -> Optional[bool]:
+        """
+        Whether the filter may contain the value, or None when it could not be
+        consulted: disabled, not rebuilt yet, or values are being loaded elsewhere.
+        """
+        if not settings.BLOOM_ENABLED:
+            return None
+        self.maybe_reload()
+        if not self.complete or self._writers_active:
+            return None
+        counters = self._counters(data_type)
+        counters["checks"] += 1
+        bloom = self.filters.get(data_type)
+        if bloom is None or value_norm not in bloom:
+            counters["rejected"] += 1
+            return False
+        return True
+
+    def might_contain(self, data_type: str, value_norm: str) -> bool:
+        """False only when the value is certainly not indexed."""
+        return self.check(data_type, value_norm) is not False
+
+    def record_false_positive(self, data_type: str):
+        """A value check() let through was not found by a complete exact lookup."""
+        self._counters(data_type)["false_positives"] += 1
+
+    def reset(self):
+        """
+        Start empty filters for a full rebuild. Refuses while another process is
+        loading values, as they could be missed by the rebuild.
+        """
+        if self._other_writers_active():
+            raise RuntimeError("Another process is indexing documents, rebuild the Bloom filters once it is done")
+        with self._lock:
+            self.filters = {}
+            self.complete = False
+            self._rebuilding = True
+
+    def stats(self):
+        result = {"enabled": settings.BLOOM_ENABLED, "complete": self.complete, "types": {}}
+        for data_type in DATA_TYPES:
+            bloom = self.filters.get(data_type)
+            counters = self._counters(data_type)
+            negatives = counters["rejected"] + counters["false_positives"]
+            result["types"][data_type] = {
+                "values": bloom.count if bloom else 0,
+                "capacity": settings.BLOOM_CAPACITY,
+                "estimated_fp_rate": round(bloom.estimated_fp_rate(), 6) if bloom else 0.0,
+                **counters,
+                # Share of absent values the filter failed to reject
+                "observed_fp_rate": round(counters["false_positives"] / negatives, 6) if negatives else 0.0,
+            }
+        return result
+
+
+_bloom_index = None
+
+
+def get_bloom_index() -> BloomIndex:
+    global _bloom_index
+    if _bloom_index is None:
+        _bloom_index = BloomIndex(settings.BLOOM_DIR)
+    return _bloom_index
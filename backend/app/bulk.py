@@ -0,0 +1,269 @@
+"""
+Concurrent streaming bulk indexing.
+
+Documents are pulled from any iterable or async iterable into a bounded
+queue, so a slow cluster holds back the reader instead of letting memory
+grow. BULK_CONCURRENCY sender tasks drain the queue into bulk requests capped
+by document count and bytes. Requests and documents rejected with 429 are
+retried with exponential backoff; every other failure is counted and written
+to a dead-letter NDJSON file together with the document.
+
+Every request first takes its documents and bytes from ingest_limiter, a
+process-wide cap (INGEST_MAX_DOCS_PER_SEC / INGEST_MAX_BYTES_PER_SEC) shared
+by all imports, so concurrent jobs can't crowd out search traffic.
+
+Every document gets a deterministic _id (app.ingest.document_id), so the op
+type decides what a re-import does:
+- create: keep the existing document (reported as unchanged)
+- index: overwrite it (always reported as updated)
+- update: upsert, leaving identical documents untouched (reported as unchanged)
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import AsyncIterator, Iterable, Union
+
+from elasticsearch import ApiError, AsyncElasticsearch, TransportError
+
+from app.config import settings
+from app.ingest import document_id
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+OP_TYPES = ["create", "index", "update"]
+
+
+async def aiter_batches(documents: Union[Iterable, AsyncIterator], size: int):
+    """Group a sync or async iterable of documents into lists of at most size."""
+    batch = []
+    if hasattr(documents, "__aiter__"):
+        async for doc in documents:
+            batch.append(doc)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+    else:
+        for doc in documents:
+            batch.append(doc)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+class DeadLetter:
+    """Append-only NDJSON file of rejected documents, created on the first rejection."""
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.count = 0
+        self._file = None
+
+    def write(self, document: dict, status, error):
+        self.count += 1
+        if self.path is None:
+            return
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(self.path, "a")
+        self._file.write(json.dumps({"status": status, "error": error, "document": document}, default=str) + "\n")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class RateLimiter:
+    """
+    Pace work to at most INGEST_MAX_DOCS_PER_SEC documents and INGEST_MAX_BYTES_PER_SEC
+    bytes per second (0 disables a cap). Each acquire reserves the next free slot, so
+    callers are served in order and bursts are spread out instead of dropped.
+    """
+
+    def __init__(self):
+        self._next = 0.0
+
+    def _interval(self, docs: int, size: int) -> float:
+        interval = 0.0
+        if settings.INGEST_MAX_DOCS_PER_SEC > 0:
+            interval = docs / settings.INGEST_MAX_DOCS_PER_SEC
+        if settings.INGEST_MAX_BYTES_PER_SEC > 0:
+            interval = max(interval, size / settings.INGEST_MAX_BYTES_PER_SEC)
+        return interval
+
+    async def acquire(self, docs: int, size: int = 0):
+        interval = self._interval(docs, size)
+        if not interval:
+            return
+        now = time.monotonic()
+        start = max(now, self._next)
+        self._next = start + interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+ingest_limiter = RateLimiter()
+
+
+def serialize(doc: dict, index: str, op_type: str):
+    """The (action, source) NDJSON lines for one document."""
+    meta = {"_index": index, "_id": document_id(doc)}
+    if settings.ELASTICSEARCH_ROUTE_BY_TYPE:
+        meta["routing"] = doc["type"]
+    if op_type == "update":
+        # Duplicate rows can be in flight in two requests at once
+        meta["retry_on_conflict"] = 3
+    action = json.dumps({op_type: meta}).encode()
+    if op_type == "update":
+        # indexed_at only on insert, so re-importing identical rows is a noop
+        fields = {key: value for key, value in doc.items() if key != "indexed_at"}
+        body = {"doc": fields, "upsert": doc}
+    else:
+        body = doc
+    return action, json.dumps(body, default=str).encode()
+
+
+def _outcome(op_type: str, info: dict):
+    """Map a bulk item to created/updated/unchanged, or None if it failed."""
+    status = info.get("status", 500)
+    if op_type == "create" and status == 409:
+        return "unchanged"
+    if not 200 <= status < 300:
+        return None
+    result = info.get("result")
+    if result == "created":
+        return "created"
+    if result == "noop":
+        return "unchanged"
+    return "updated"
+
+
+def _backoff(attempt: int) -> float:
+    return min(settings.BULK_MAX_BACKOFF, settings.BULK_INITIAL_BACKOFF * 2 ** (attempt - 1))
+
+
+async def send_chunk(client: AsyncElasticsearch, chunk: list, lines: list, dead_letter: DeadLetter) -> dict:
+    """
+    Send one bulk request, retrying 429s, and return counts of created, updated,
+    unchanged and failed documents.
+    chunk holds the documents and lines their serialized (action, source) pairs.
+    """
+    pending = list(range(len(chunk)))
+    counts = {"created": 0, "updated": 0, "unchanged": 0, "failed": 0}
+    rejected = []
+    for attempt in range(settings.BULK_MAX_RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(_backoff(attempt))
+        last_attempt = attempt == settings.BULK_MAX_RETRIES
+        try:
+            response = await client.bulk(operations=[line for i in pending for line in lines[i]])
+        except ApiError as e:
+            if e.status_code == 429 and not last_attempt:
+                continue
+            rejected.extend((i, e.status_code, str(e)) for i in pending)
+            break
+        except TransportError as e:
+            # Connection errors and timeouts: back off and resend the whole request
+            if not last_attempt:
+                logger.warning(f"Bulk request failed ({e}), retrying")
+                continue
+            rejected.extend((i, None, str(e)) for i in pending)
+            break
+
+        retry = []
+        for i, item in zip(pending, response["items"]):
+            op_type, info = next(iter(item.items()))
+            status = info.get("status", 500)
+            outcome = _outcome(op_type, info)
+            if outcome is not None:
+                counts[outcome] += 1
+            elif status == 429 and not last_attempt:
+                retry.append(i)
+            else:
+                rejected.append((i, status, info.get("error")))
+        if not retry:
+            break
+        pending = retry
+    for i, status, error in rejected:
+        dead_letter.write(chunk[i], status, error)
+    counts["failed"] = len(rejected)
+    return counts
+
+
+async def stream_bulk(
+    client: AsyncElasticsearch,
+    documents: Union[Iterable, AsyncIterator],
+    index: str,
+    dead_letter_path: str = None,
+    progress: dict = None,
+    concurrency: int = None,
+    op_type: str = None,
+):
+    """
+    Index documents from a (possibly async) generator and return (success, failed).
+    When given, progress is advanced after every request: "processed" and "failed",
+    plus the "created", "updated" and "unchanged" breakdown of processed.
+    """
+    op_type = op_type or settings.BULK_OP_TYPE
+    if op_type not in OP_TYPES:
+        raise ValueError(f"Unknown bulk op type: {op_type}")
+    concurrency = concurrency or settings.BULK_CONCURRENCY
+    queue = asyncio.Queue(maxsize=settings.BULK_QUEUE_SIZE)
+    dead_letter = DeadLetter(dead_letter_path)
+    totals = {"success": 0}
+
+    async def produce():
+        try:
+            async for batch in aiter_batches(documents, settings.BULK_CHUNK_DOCS):
+                for doc in batch:
+                    await queue.put(doc)
+        finally:
+            for _ in range(concurrency):
+                await queue.put(_DONE)
+
+    async def flush(chunk, lines, size):
+        await ingest_limiter.acquire(len(chunk), size)
+        counts = await send_chunk(client, chunk, lines, dead_letter)
+        success = counts["created"] + counts["updated"] + counts["unchanged"]
+        totals["success"] += success
+        if progress is not None:
+            progress["processed"] = progress.get("processed", 0) + success
+            for key, count in counts.items():
+                progress[key] = progress.get(key, 0) + count
+
+    async def send():
+        chunk, lines, size = [], [], 0
+        while True:
+            doc = await queue.get()
+            if doc is _DONE:
+                break
+            action, source = serialize(doc, index, op_type)
+            doc_bytes = len(action) + len(source) + 2
+            if chunk and size + doc_bytes > settings.BULK_CHUNK_BYTES:
+                await flush(chunk, lines, size)
+                chunk, lines, size = [], [], 0
+            chunk.append(doc)
+            lines.append((action, source))
+            size += doc_bytes
+            if len(chunk) >= settings.BULK_CHUNK_DOCS:
+                await flush(chunk, lines, size)
+                chunk, lines, size = [], [], 0
+        if chunk:
+            await flush(chunk, lines, size)
+
+    tasks = [asyncio.ensure_future(produce())] + [asyncio.ensure_future(send()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        dead_letter.close()
+    if dead_letter.count:
+        logger.warning(f"{dead_letter.count} documents rejected, see {dead_letter.path}")
+    return totals["success"], dead_letter.count
@@ -12,7 +12,72 @@ class Settings(BaseSettings):
     
     # Elasticsearch
     ELASTICSEARCH_HOST: str = "http://localhost:9200"
-    ELASTICSEARCH_INDEX: str = "osint_data"
+    ELASTICSEARCH_INDEX: str = "osint_data"  # read alias over the osint_data_v{n} index versions
+    ELASTICSEARCH_WRITE_ALIAS: str = "osint_data_write"
+    # Layout of new index versions; changing these takes a scripts/reindex.py run
+    ELASTICSEARCH_SHARDS: int = 1
+    ELASTICSEARCH_REPLICAS: int = 1
+    ELASTICSEARCH_ROUTE_BY_TYPE: bool = False  # keep each data type on one shard
+    ELASTICSEARCH_POOL_SIZE: int = 10  # pooled connections per ES node
+    ELASTICSEARCH_REQUEST_TIMEOUT: int = 30  # seconds, default for every call
+    ELASTICSEARCH_SEARCH_TIMEOUT: int = 10  # seconds, per search call
+    ELASTICSEARCH_BULK_TIMEOUT: int = 60  # seconds, per bulk request
+    ELASTICSEARCH_MAX_RETRIES: int = 3
+
+    # Bulk indexing
+    BULK_OP_TYPE: str = "update"  # create (skip existing), index (overwrite) or update (upsert)
+    BULK_CONCURRENCY: int = 4  # bulk requests in flight at once
+    BULK_CHUNK_DOCS: int = 1000
+    BULK_CHUNK_BYTES: int = 10 * 1024 * 1024
+    BULK_QUEUE_SIZE: int = 10000  # documents buffered ahead of the senders
+    BULK_MAX_RETRIES: int = 5  # retries of requests/documents rejected with 429
+    BULK_INITIAL_BACKOFF: float = 2.0  # seconds, doubled on every retry
+    BULK_MAX_BACKOFF: float = 60.0
+    DEAD_LETTER_DIR: str = "./dead_letter"
+    BULK_FORCE_MERGE_SEGMENTS: int = 1  # target segments per shard after a bulk-mode load
+    REINDEX_REQUESTS_PER_SECOND: float = 5000  # _reindex throttle, -1 for unthrottled
+    
+    # Search
+    # Backend: "elasticsearch", "local" (embedded on-disk index), or
+    # "auto" (Elasticsearch, falling back to the local index if ES is down at startup)
+    SEARCH_BACKEND: str = "auto"
+    LOCAL_INDEX_DIR: str = "./local_index"
+    LOCAL_SEGMENT_MAX_DOCS: int = 2000000  # documents per on-disk segment
+    LOCAL_MERGE_FACTOR: int = 10  # segments of a size merged into one as documents are added
+    LOCAL_VERIFY_LIMIT: int = 100000  # candidates verified per segment before counts are extrapolated
+    SEARCH_LEGACY_WILDCARD: bool = False  # leading-wildcard substring match for indices without value.ngram
+    DEFAULT_PHONE_COUNTRY_CODE: str = "91"  # used to put local phone numbers in E.164
+    SEARCH_CACHE_SIZE: int = 1024  # cached (query, type) results; 0 disables the cache
+    SEARCH_CACHE_TTL: int = 300  # seconds
+    SEARCH_PIT_KEEP_ALIVE: str = "2m"  # how long a paginated search stays open between pages
+    SEARCH_PAGES_PER_CREDIT: int = 5  # pages after the first cost one credit per N pages; 0 makes them free
+    SEARCH_BATCH_MAX: int = 200  # most (query, type) pairs accepted by /api/search/batch
+    SEARCH_TIER_MIN_RESULTS: int = 10  # stop before the next, costlier tier once this many results are found
+    SEARCH_TIER_BUDGETS: dict = {
+        "exact": {"timeout": "500ms"},
+        "phrase": {"timeout": "1s"},
+        "substring": {"timeout": "2s", "terminate_after": 500000},
+        "fuzzy": {"timeout": "3s", "terminate_after": 100000},
+    }
+    BLOOM_ENABLED: bool = True  # reject absent exact identifiers without querying
+    BLOOM_DIR: str = "./bloom"
+    BLOOM_CAPACITY: int = 10000000  # values per type before the false-positive rate climbs
+    BLOOM_FP_RATE: float = 0.01
+    BLOOM_WRITER_TIMEOUT: int = 60  # seconds before a silent indexing process's marker is ignored
+    
+    # Jobs
+    JOB_RESULTS_DIR: str = "./job_results"
+    UPLOAD_DIR: str = "./uploads"  # spooled job files, kept until the job ends so it can resume
+    JOB_LEASE_SECONDS: int = 300  # a running job without a checkpoint for this long is taken over on startup
+    UPLOAD_CHUNK_ROWS: int = 10000  # rows parsed from an uploaded file at a time
+    ENRICH_CHUNK_ROWS: int = 10000  # identifier rows read from the upload at a time
+    ENRICH_BATCH_SIZE: int = 100  # identifiers per _msearch request
+    ENRICH_CONCURRENCY: int = 4  # _msearch requests in flight per job
+    ENRICH_MAX_BYTES: int = 50 * 1024 * 1024  # largest identifier file accepted
+    ENRICH_MAX_ROWS: int = 100000  # identifiers per job; each one costs a search
+    JOB_WORKERS: int = 2  # jobs run at once per API process; the rest wait in the queue
+    INGEST_MAX_DOCS_PER_SEC: int = 0  # indexing cap per process across all imports; 0 = unlimited
+    INGEST_MAX_BYTES_PER_SEC: int = 0  # same, in bulk request bytes
     
     # Security
     SECRET_KEY: str = "your-secret-key-change-in-production"
@@ -22,7 +22,7 @@ def get_db():
 
 def init_db():
     """Initialize database tables."""
-    from app.models import User, Team, SearchLog
+    from app.models import User, Team, SearchLog, IngestJob, ImportManifest, ManifestChunk
     
     Base.metadata.create_all(bind=engine)
     print("Database initialized successfully")
@@ -1,126 +1,769 @@
-from elasticsearch import Elasticsearch
+from elasticsearch import AsyncElasticsearch, NotFoundError
 from app.config import settings
+from app.normalizers import classify_identifier, normalize_value, DATA_TYPES
+from app.bloom import get_bloom_index
+from app.search_cache import search_cache
+from app.local_index import LocalIndex, local_backend
+from app.bulk import aiter_batches, stream_bulk
 import logging
+from contextlib import asynccontextmanager
+from typing import AsyncContextManager, AsyncIterator, Protocol, Tuple
 
 logger = logging.getLogger(__name__)
 
-# Initialize Elasticsearch client
-es = Elasticsearch(
-    [settings.ELASTICSEARCH_HOST],
-    request_timeout=30,
-    max_retries=10,
-    retry_on_timeout=True
-)
+KEEP_ALIVE_UNITS = {"d": 86400, "h": 3600, "m": 60, "s": 1, "ms": 0.001}
+SEARCH_TIERS = ["exact", "phrase", "substring", "fuzzy"]
 
+_es = None
+_backend = settings.SEARCH_BACKEND  # "elasticsearch", "local", or "auto" until startup decides
 
-async def create_index_if_not_exists():
-    """Create the OSINT data index with proper mapping if it doesn't exist."""
-    index_name = settings.ELASTICSEARCH_INDEX
-    
-    if not es.indices.exists(index=index_name):
-        mapping = {
-            "mappings": {
-                "properties": {
-                    "type": {"type": "keyword"},
-                    "value": {"type": "text", "analyzer": "standard"},
-                    "source": {"type": "keyword"},
-                    "additional_info": {"type": "text"},
-                    "indexed_at": {"type": "date"}
+
+def use_local_backend() -> bool:
+    """Whether searches and indexing go to the embedded local index."""
+    return _backend == "local"
+
+
+def activate_local_fallback() -> bool:
+    """With SEARCH_BACKEND=auto, switch to the local index if one has been built."""
+    global _backend
+    if _backend == "auto" and LocalIndex.exists(settings.LOCAL_INDEX_DIR):
+        _backend = "local"
+        logger.info(f"Using local search index at {settings.LOCAL_INDEX_DIR}")
+        return True
+    return False
+
+
+def set_backend(name: str):
+    """Select the backend explicitly, e.g. from the import script."""
+    global _backend
+    _backend = name
+
+
+class SearchBackend(Protocol):
+    """
+    What searching and indexing need from a backend: ElasticsearchBackend below,
+    or LocalBackend (app.local_index) for the embedded index.
+    """
+
+    async def create_index(self): ...
+
+    def bulk_load_mode(self, force_merge: bool = False, index_name: str = None) -> AsyncContextManager: ...
+
+    async def index_documents(self, documents: AsyncIterator, dead_letter_path: str = None, progress: dict = None,
+                              concurrency: int = None, op_type: str = None, index_name: str = None) -> Tuple[int, int]:
+        """Index documents and return (success, failed)."""
+
+    async def delete_documents(self, ids: list, index_name: str = None) -> int: ...
+
+    async def search_tier(self, tier: str, query: str, data_type: str, identifier,
+                          per_type: int = 10) -> Tuple[dict, dict]:
+        """Grouped results of one tier, and the response fields tier_report reads."""
+
+    async def msearch_tiers(self, searches: list, per_type: int = 10) -> list:
+        """search_tier for many (tier, query, data_type, identifier); an Exception for each that failed."""
+
+    async def search_page(self, query: str, data_type: str, size: int, pit_id: str, search_after: list,
+                          exact: bool, identifier) -> dict: ...
+
+    def scan_documents(self) -> AsyncIterator[dict]: ...
+
+    async def stats(self) -> dict: ...
+
+
+def get_backend() -> SearchBackend:
+    """The backend searches and indexing go to."""
+    if use_local_backend():
+        return local_backend
+    return elasticsearch_backend
+
+
+def get_es() -> AsyncElasticsearch:
+    """Return the shared async Elasticsearch client, creating it on first use."""
+    global _es
+    if _es is None:
+        _es = AsyncElasticsearch(
+            [settings.ELASTICSEARCH_HOST],
+            connections_per_node=settings.ELASTICSEARCH_POOL_SIZE,
+            request_timeout=settings.ELASTICSEARCH_REQUEST_TIMEOUT,
+            max_retries=settings.ELASTICSEARCH_MAX_RETRIES,
+            retry_on_timeout=True
+        )
+    return _es
+
+
+async def close_es():
+    """Close the shared client and release its pooled connections."""
+    global _es
+    if _es is not None:
+        await _es.close()
+        _es = None
+
+
+def type_routing(data_type: str = None):
+    """Shard routing value for documents or searches of one type, if routing by type is on."""
+    if settings.ELASTICSEARCH_ROUTE_BY_TYPE and data_type:
+        return data_type
+    return None
+
+
+def index_definition() -> dict:
+    """Mappings and settings for a new physical index version."""
+    definition = {
+        "mappings": {
+            "properties": {
+                "type": {"type": "keyword"},
+                "value": {
+                    "type": "text",
+                    "analyzer": "standard",
+                    "fields": {
+                        # 2-3 character grams so "contains" is a term lookup
+                        "ngram": {"type": "text", "analyzer": "value_ngram"}
+                    }
+                },
+                # Canonical form from app.normalizers, for exact lookups
+                "value_norm": {"type": "keyword"},
+                "source": {"type": "keyword"},
+                "additional_info": {"type": "text"},
+                "indexed_at": {"type": "date"}
+            }
+        },
+        "settings": {
+            "number_of_shards": settings.ELASTICSEARCH_SHARDS,
+            "number_of_replicas": settings.ELASTICSEARCH_REPLICAS,
+            "analysis": {
+                "tokenizer": {
+                    "value_ngram": {
+                        "type": "ngram",
+                        "min_gram": 2,
+                        "max_gram": 3,
+                        "token_chars": []
+                    }
+                },
+                "analyzer": {
+                    "value_ngram": {
+                        "type": "custom",
+                        "tokenizer": "value_ngram",
+                        "filter": ["lowercase"]
+                    }
                 }
-            },
-            "settings": {
-                "number_of_shards": 1,
-                "number_of_replicas": 1
             }
         }
-        
+    }
+    if settings.ELASTICSEARCH_ROUTE_BY_TYPE:
+        # Each type lives on one shard; reject writes that would land elsewhere
+        definition["mappings"]["_routing"] = {"required": True}
+    return definition
+
+
+def versioned_index_name(version: int) -> str:
+    return f"{settings.ELASTICSEARCH_INDEX}_v{version}"
+
+
+async def get_index_versions() -> list:
+    """Versions of the physical osint_data_v{n} indices that exist, ascending."""
+    prefix = f"{settings.ELASTICSEARCH_INDEX}_v"
+    indices = await get_es().indices.get(index=f"{prefix}*", allow_no_indices=True, expand_wildcards="all")
+    return sorted(int(name[len(prefix):]) for name in indices if name[len(prefix):].isdigit())
+
+
+async def get_alias_target(alias: str):
+    """The physical index behind an alias, the name itself for a concrete index, or None."""
+    es = get_es()
+    if await es.indices.exists_alias(name=alias):
+        return next(iter(await es.indices.get_alias(name=alias)))
+    if await es.indices.exists(index=alias):
+        return alias
+    return None
+
+
+async def create_index_if_not_exists():
+    """
+    Create the first index version behind the read alias (ELASTICSEARCH_INDEX) and the
+    write alias (ELASTICSEARCH_WRITE_ALIAS) if neither exists yet.
+    """
+    await get_backend().create_index()
+
+
+async def swap_aliases(new_index: str, read: bool = True, write: bool = True):
+    """
+    Atomically point the read and/or write alias at new_index. A concrete index
+    still carrying the read alias name (created before versioning) is deleted in
+    the same request, since an alias cannot share its name.
+    """
+    actions = []
+    deleted = set()
+    targets = []
+    if read:
+        targets.append((settings.ELASTICSEARCH_INDEX, {}))
+    if write:
+        targets.append((settings.ELASTICSEARCH_WRITE_ALIAS, {"is_write_index": True}))
+    for alias, options in targets:
+        current = await get_alias_target(alias)
+        if current == alias:
+            actions.append({"remove_index": {"index": alias}})
+            deleted.add(alias)
+        elif current is not None and current not in deleted:
+            actions.append({"remove": {"index": current, "alias": alias}})
+        actions.append({"add": {"index": new_index, "alias": alias, **options}})
+    await get_es().indices.update_aliases(actions=actions)
+    logger.info(f"Aliases {[alias for alias, _ in targets]} now point to {new_index}")
+
+
+# Index settings for the duration of a bulk load: no periodic refreshes, no replica writes
+BULK_MODE_SETTINGS = {"refresh_interval": "-1", "number_of_replicas": 0}
+_bulk_mode_users = 0
+
+
+async def _saved_index_settings(es, index_name: str):
+    """Original settings recorded in the mapping _meta by an unfinished bulk load, if any."""
+    mapping = await es.indices.get_mapping(index=index_name)
+    for index in mapping.values():
+        saved = index["mappings"].get("_meta", {}).get("bulk_load")
+        if saved:
+            return saved
+    return None
+
+
+async def restore_index_settings(index_name: str = None):
+    """Put back the settings saved by a bulk load that did not finish. Returns them, or None."""
+    es = get_es()
+    index_name = index_name or settings.ELASTICSEARCH_WRITE_ALIAS
+    saved = await _saved_index_settings(es, index_name)
+    if saved is None:
+        return None
+    original = {key: saved.get(key) for key in BULK_MODE_SETTINGS}
+    await es.indices.put_settings(index=index_name, settings={"index": original})
+    await es.indices.put_mapping(index=index_name, meta={})
+    await es.indices.refresh(index=index_name)
+    logger.info(f"Restored index settings {original}")
+    return original
+
+
+def bulk_load_mode(force_merge: bool = False, index_name: str = None) -> AsyncContextManager:
+    """
+    Turn off refreshes and replicas for a large load, restoring them afterwards even if it fails.
+    The original values are kept in the index mapping _meta first, so a crashed load can be
+    undone with restore_index_settings() (scripts/import_data.py --restore-settings).
+    """
+    return get_backend().bulk_load_mode(force_merge, index_name)
+
+
+async def bulk_index_data(documents, dead_letter_path: str = None, progress: dict = None, concurrency: int = None,
+                          op_type: str = None, index_name: str = None):
+    """
+    Bulk index documents from a list or a (possibly async) generator into the write alias
+    (or index_name). Returns (success, failed); rejected documents go to dead_letter_path.
+    op_type (create, index or update) decides what happens to documents that already exist.
+    The Bloom filters are saved once the documents are in.
+    """
+    bloom = get_bloom_index()
+
+    async def tracked():
+        async for batch in aiter_batches(documents, settings.BULK_CHUNK_DOCS):
+            for doc in batch:
+                bloom.add(doc["type"], doc.get("value_norm") or normalize_value(doc["type"], str(doc["value"])))
+                yield doc
+
+    async with bloom.writing():
         try:
-            es.indices.create(index=index_name, body=mapping)
-            logger.info(f"Created Elasticsearch index: {index_name}")
+            success, failed = await get_backend().index_documents(
+                tracked(), dead_letter_path, progress, concurrency, op_type, index_name
+            )
+            logger.info(f"Bulk indexed {success} documents, failed: {failed}")
+            return success, failed
         except Exception as e:
-            logger.error(f"Error creating index: {e}")
+            logger.error(f"Error bulk indexing: {e}")
             raise
+        finally:
+            search_cache.bump_generation()
+
+
+async def delete_documents(ids: list, index_name: str = None) -> int:
+    """Delete documents by _id from the write alias (or index_name) and return how many went."""
+    try:
+        return await get_backend().delete_documents(ids, index_name)
+    finally:
+        search_cache.bump_generation()
+
+
+def with_type_aggs(query_clause: dict, per_type: int = 10):
+    """Wrap a query so ES returns per-type counts and top hits in one round trip."""
+    return {
+        "query": query_clause,
+        "size": 0,
+        "aggs": {
+            "by_type": {
+                "terms": {"field": "type", "size": len(DATA_TYPES) * 2},
+                "aggs": {
+                    "top_hits": {"top_hits": {"size": per_type}}
+                }
+            }
+        }
+    }
+
+
+def build_search_clause(query: str, data_type: str = None, tier: str = "fuzzy"):
+    """
+    Build the bool query clause used for free-text searches.
+    Each tier adds its clause to the previous ones, so "fuzzy" is the full query.
+    """
+    if settings.SEARCH_LEGACY_WILDCARD:
+        # Indices created before the value.ngram subfield existed
+        substring_clause = {"wildcard": {"value": f"*{query}*"}}
     else:
-        logger.info(f"Index {index_name} already exists")
+        substring_clause = {"match": {"value.ngram": {"query": query, "operator": "and"}}}
 
+    tier_clauses = {
+        "phrase": {"match_phrase": {"value": query}},
+        "substring": substring_clause,
+        "fuzzy": {"fuzzy": {"value": {"value": query, "fuzziness": 2}}}
+    }
+    should = []
+    for name, clause in tier_clauses.items():
+        should.append(clause)
+        if name == tier:
+            break
 
-async def bulk_index_data(documents: list):
-    """Bulk index documents to Elasticsearch."""
-    if not documents:
-        return
+    bool_query = {
+        "bool": {
+            "should": should,
+            "minimum_should_match": 1
+        }
+    }
     
-    actions = []
-    for doc in documents:
-        action = {
-            "_index": settings.ELASTICSEARCH_INDEX,
-            "_source": doc
+    # Add type filter if specified
+    if data_type:
+        bool_query["bool"]["filter"] = [{"term": {"type": data_type}}]
+
+    return bool_query
+
+
+def build_exact_clause(normalized: str, data_type: str):
+    """Build a single term lookup for a fully formed identifier."""
+    return {
+        "bool": {
+            "filter": [
+                {"term": {"value_norm": normalized}},
+                {"term": {"type": data_type}}
+            ]
         }
-        actions.append(action)
+    }
+
+
+def plan_tiers(query: str, data_type: str = None, fuzzy: bool = False):
+    """
+    Return the identifier (or None), the tiers to try, cheapest first, and whether
+    the Bloom filter was consulted and let the identifier through.
+    Fully formed identifiers only get the fuzzy tier when asked for. One the Bloom
+    filter rejects skips the exact tier; the others still run, as it may be part of
+    another value, unless the search is restricted to the identifier's own type.
+    """
+    identifier = classify_identifier(query, data_type)
+    if not identifier:
+        return None, SEARCH_TIERS[1:], False
+    plan = SEARCH_TIERS if fuzzy else SEARCH_TIERS[:-1]
+    present = get_bloom_index().check(identifier[0], identifier[1])
+    if present is False:
+        return identifier, [] if data_type else plan[1:], False
+    return identifier, plan, present is True
+
+
+def build_tier_query(tier: str, query: str, data_type: str, identifier, per_type: int = 10):
+    """Build the aggregated request body for one tier, with its timeout and terminate_after budget."""
+    if tier == "exact":
+        clause = build_exact_clause(identifier[1], identifier[0])
+    else:
+        clause = build_search_clause(query, data_type, tier)
+    body = with_type_aggs(clause, per_type)
+    budget = settings.SEARCH_TIER_BUDGETS.get(tier, {})
+    if budget.get("timeout"):
+        body["timeout"] = budget["timeout"]
+    if budget.get("terminate_after"):
+        body["terminate_after"] = budget["terminate_after"]
+    return body
+
+
+def tier_routing(tier: str, data_type: str, identifier):
+    """
+    Shard routing for one tier: its type filter, or for an exact lookup the detected
+    identifier type. Unfiltered tiers go to every shard, which ES searches in parallel.
+    """
+    if tier == "exact":
+        return type_routing(identifier[0])
+    return type_routing(data_type)
+
+
+def tier_satisfied(tier: str, results: dict) -> bool:
+    """Whether results are good enough to skip the remaining, more expensive tiers."""
+    total = sum(group["count"] for group in results.values())
+    if tier == "exact":
+        # An exact identifier match is the answer, however few hits it has
+        return total > 0
+    return total >= settings.SEARCH_TIER_MIN_RESULTS
+
+
+def merge_tier_results(previous: dict, current: dict) -> dict:
+    """Later tiers match a superset, unless a budget cut them short."""
+    if not previous:
+        return current
+    previous_total = sum(group["count"] for group in previous.values())
+    current_total = sum(group["count"] for group in current.values())
+    return current if current_total >= previous_total else previous
+
+
+def tier_report(tier: str, data_type: str, response) -> dict:
+    return {
+        "tier": tier,
+        "type": data_type or "all",
+        "took_ms": response.get("took"),
+        "timed_out": response.get("timed_out", False),
+        "terminated_early": response.get("terminated_early", False)
+    }
+
+
+def format_hit(hit):
+    """Convert an ES hit into the result dict returned by the API."""
+    return {
+        "type": hit["_source"]["type"],
+        "value": hit["_source"]["value"],
+        "source": hit["_source"].get("source", ""),
+        "additional_info": hit["_source"].get("additional_info", ""),
+        "score": hit["_score"]
+    }
+
+
+def group_buckets(response):
+    """Turn the by_type aggregation into {type: {"count": n, "results": [...]}}."""
+    grouped_results = {}
+    for bucket in response["aggregations"]["by_type"]["buckets"]:
+        grouped_results[bucket["key"]] = {
+            "count": bucket["doc_count"],
+            "results": [format_hit(hit) for hit in bucket["top_hits"]["hits"]["hits"]]
+        }
+    return grouped_results
+
+
+async def search_data(
+    query: str,
+    data_type: str = None,
+    per_type: int = 10,
+    tiers: list = None,
+    fuzzy: bool = False
+):
+    """
+    Search the Elasticsearch index with optional type filter.
+    Returns accurate per-type counts and the top per_type hits of each type.
+    Tiers run cheapest first (exact, phrase, substring, fuzzy) and stop once
+    enough results are found; pass a list as tiers to collect what ran.
+    """
+    backend = get_backend()
+    identifier, plan, bloom_passed = plan_tiers(query, data_type, fuzzy)
+    results = {}
+    if not plan and tiers is not None:
+        tiers.append({"tier": "bloom", "type": data_type or "all", "took_ms": 0, "timed_out": False, "terminated_early": False})
     
     try:
-        from elasticsearch.helpers import bulk
-        success, failed = bulk(es, actions, chunk_size=10000, request_timeout=60)
-        logger.info(f"Bulk indexed {success} documents, failed: {failed}")
-        return success, failed
+        for tier in plan:
+            grouped, response = await backend.search_tier(tier, query, data_type, identifier, per_type)
+            results = merge_tier_results(results, grouped)
+            if tiers is not None:
+                tiers.append(tier_report(tier, data_type, response))
+            if tier == "exact" and bloom_passed and not results and not response.get("timed_out"):
+                get_bloom_index().record_false_positive(identifier[0])
+            if tier_satisfied(tier, results):
+                break
+        return results
     except Exception as e:
-        logger.error(f"Error bulk indexing: {e}")
+        logger.error(f"Search error: {e}")
         raise
 
 
-async def search_data(query: str, data_type: str = None, size: int = 100):
-    """Search the Elasticsearch index with optional type filter."""
-    search_query = {
-        "query": {
-            "bool": {
-                "should": [
-                    {"match_phrase": {"value": query}},
-                    {"wildcard": {"value": f"*{query}*"}},
-                    {"fuzzy": {"value": {"value": query, "fuzziness": 2}}}
-                ],
-                "minimum_should_match": 1
-            }
-        },
-        "size": size
-    }
-    
-    # Add type filter if specified
-    if data_type:
-        search_query["query"]["bool"]["filter"] = [{"term": {"type": data_type}}]
+async def msearch_data(queries: list, per_type: int = 10, fuzzy: bool = False):
+    """
+    Run many (query, data_type) searches through _msearch.
+    Returns one entry per input, in order: grouped results as from
+    search_data, or an Exception if that search failed.
+    Each round sends the next tier for every search that still needs one.
+    """
+    backend = get_backend()
+    results = [{} for _ in queries]
+    plans = [plan_tiers(query, data_type, fuzzy) for query, data_type in queries]
+    positions = [0] * len(queries)
     
     try:
-        response = es.search(index=settings.ELASTICSEARCH_INDEX, body=search_query)
-        results = []
+        # Identifiers rejected by the Bloom filter never reach ES
+        active = [i for i, (_, plan, _) in enumerate(plans) if plan]
+        while active:
+            searches = [(plans[i][1][positions[i]], queries[i][0], queries[i][1], plans[i][0]) for i in active]
+            responses = await backend.msearch_tiers(searches, per_type)
+            
+            next_active = []
+            for i, outcome in zip(active, responses):
+                if isinstance(outcome, Exception):
+                    results[i] = outcome
+                    continue
+                grouped, item = outcome
+                results[i] = merge_tier_results(results[i], grouped)
+                tier = plans[i][1][positions[i]]
+                positions[i] += 1
+                if tier == "exact" and plans[i][2] and not results[i] and not item.get("timed_out"):
+                    get_bloom_index().record_false_positive(plans[i][0][0])
+                if not tier_satisfied(tier, results[i]) and positions[i] < len(plans[i][1]):
+                    next_active.append(i)
+            active = next_active
         
-        for hit in response["hits"]["hits"]:
-            results.append({
-                "type": hit["_source"]["type"],
-                "value": hit["_source"]["value"],
-                "source": hit["_source"].get("source", ""),
-                "additional_info": hit["_source"].get("additional_info", ""),
-                "score": hit["_score"]
-            })
-        
-        # Group results by type
-        grouped_results = {}
-        for result in results:
-            dtype = result["type"]
-            if dtype not in grouped_results:
-                grouped_results[dtype] = []
-            grouped_results[dtype].append(result)
-        
-        return grouped_results
+        return results
     except Exception as e:
-        logger.error(f"Search error: {e}")
+        logger.error(f"Multi-search error: {e}")
         raise
 
 
-async def get_index_stats():
-    """Get statistics about the Elasticsearch index."""
+class PointInTimeExpired(Exception):
+    """The point in time a page was read from is gone: its keep-alive ran out or it was closed."""
+
+
+def keep_alive_seconds(keep_alive: str) -> float:
+    """Seconds in an ES time value such as "2m" or "90s"."""
+    for unit in sorted(KEEP_ALIVE_UNITS, key=len, reverse=True):
+        if keep_alive.endswith(unit) and keep_alive[:-len(unit)].isdigit():
+            return int(keep_alive[:-len(unit)]) * KEEP_ALIVE_UNITS[unit]
+    raise ValueError(f"Unsupported keep-alive: {keep_alive}")
+
+
+async def search_page(
+    query: str,
+    data_type: str,
+    size: int = 10,
+    pit_id: str = None,
+    search_after: list = None,
+    exact: bool = None
+):
+    """
+    Fetch one page of hits for a single type from a point-in-time.
+    The first call (no pit_id) opens the PIT; pass the returned pit_id,
+    search_after and exact back in to read the next page. Raises
+    PointInTimeExpired if the PIT is no longer open.
+    """
+    identifier = classify_identifier(query, data_type)
+    if exact is None:
+        exact = identifier is not None
+    return await get_backend().search_page(query, data_type, size, pit_id, search_after, exact, identifier)
+
+
+async def close_point_in_time(pit_id: str):
+    """Release a point-in-time; it would otherwise live until keep_alive runs out."""
     try:
-        stats = es.indices.stats(index=settings.ELASTICSEARCH_INDEX)
-        return {
-            "total_documents": stats["indices"][settings.ELASTICSEARCH_INDEX]["total"]["docs"]["count"]
-        }
+        await get_es().close_point_in_time(id=pit_id)
     except Exception as e:
-        logger.error(f"Error getting stats: {e}")
-        return {}
+        logger.warning(f"Error closing point in time: {e}")
+
+
+class ElasticsearchBackend:
+    """The Elasticsearch cluster: searches go to the read alias, writes to the write alias."""
+
+    async def create_index(self):
+        read_alias = settings.ELASTICSEARCH_INDEX
+        write_alias = settings.ELASTICSEARCH_WRITE_ALIAS
+        es = get_es()
+        current = await get_alias_target(read_alias)
+        if current is None:
+            index_name = versioned_index_name(1)
+            body = index_definition()
+            body["aliases"] = {read_alias: {}, write_alias: {"is_write_index": True}}
+            try:
+                await es.indices.create(index=index_name, body=body)
+                logger.info(f"Created Elasticsearch index: {index_name}")
+            except Exception as e:
+                logger.error(f"Error creating index: {e}")
+                raise
+        else:
+            logger.info(f"Index {current} already exists")
+            if not await es.indices.exists_alias(name=write_alias):
+                # Indices created before aliases were introduced are written in place
+                await es.indices.put_alias(index=current, name=write_alias)
+                logger.info(f"Added write alias {write_alias} to {current}")
+
+    @asynccontextmanager
+    async def bulk_load_mode(self, force_merge: bool = False, index_name: str = None):
+        global _bulk_mode_users
+        es = get_es()
+        index_name = index_name or settings.ELASTICSEARCH_WRITE_ALIAS
+        _bulk_mode_users += 1
+        try:
+            if _bulk_mode_users == 1:
+                # Keep values saved by an earlier load, the current ones may be its bulk settings
+                if await _saved_index_settings(es, index_name) is None:
+                    current = await es.indices.get_settings(index=index_name, flat_settings=True)
+                    current = next(iter(current.values()))["settings"]
+                    original = {key: current.get(f"index.{key}") for key in BULK_MODE_SETTINGS}
+                    await es.indices.put_mapping(index=index_name, meta={"bulk_load": original})
+                await es.indices.put_settings(index=index_name, settings={"index": BULK_MODE_SETTINGS})
+                logger.info(f"Bulk load mode on for {index_name}")
+            yield
+        finally:
+            _bulk_mode_users -= 1
+            if _bulk_mode_users == 0:
+                await restore_index_settings(index_name)
+                logger.info(f"Bulk load mode off for {index_name}")
+                if force_merge:
+                    # Runs in the background on the cluster; can take long on large indices
+                    response = await es.indices.forcemerge(
+                        index=index_name, max_num_segments=settings.BULK_FORCE_MERGE_SEGMENTS, wait_for_completion=False
+                    )
+                    logger.info(f"Started force merge of {index_name}: task {response.get('task')}")
+
+    async def index_documents(self, documents, dead_letter_path: str = None, progress: dict = None,
+                              concurrency: int = None, op_type: str = None, index_name: str = None):
+        return await stream_bulk(
+            get_es().options(request_timeout=settings.ELASTICSEARCH_BULK_TIMEOUT),
+            documents,
+            index_name or settings.ELASTICSEARCH_WRITE_ALIAS,
+            dead_letter_path=dead_letter_path,
+            progress=progress,
+            concurrency=concurrency,
+            op_type=op_type,
+        )
+
+    async def delete_documents(self, ids: list, index_name: str = None) -> int:
+        es = get_es().options(request_timeout=settings.ELASTICSEARCH_BULK_TIMEOUT)
+        deleted = 0
+        for start in range(0, len(ids), settings.BULK_CHUNK_DOCS):
+            # An ids query reaches every shard, so it works whatever the document's routing
+            response = await es.delete_by_query(
+                index=index_name or settings.ELASTICSEARCH_WRITE_ALIAS,
+                query={"ids": {"values": ids[start:start + settings.BULK_CHUNK_DOCS]}},
+                conflicts="proceed",
+            )
+            deleted += response["deleted"]
+        return deleted
+
+    async def search_tier(self, tier: str, query: str, data_type: str, identifier, per_type: int = 10):
+        es = get_es().options(request_timeout=settings.ELASTICSEARCH_SEARCH_TIMEOUT)
+        response = await es.search(
+            index=settings.ELASTICSEARCH_INDEX,
+            body=build_tier_query(tier, query, data_type, identifier, per_type),
+            routing=tier_routing(tier, data_type, identifier)
+        )
+        return group_buckets(response), response
+
+    async def msearch_tiers(self, searches: list, per_type: int = 10) -> list:
+        es = get_es().options(request_timeout=settings.ELASTICSEARCH_SEARCH_TIMEOUT)
+        body = []
+        for tier, query, data_type, identifier in searches:
+            header = {"index": settings.ELASTICSEARCH_INDEX}
+            routing = tier_routing(tier, data_type, identifier)
+            if routing:
+                header["routing"] = routing
+            body.extend([header, build_tier_query(tier, query, data_type, identifier, per_type)])
+        response = await es.msearch(searches=body)
+        results = []
+        for item in response["responses"]:
+            if "error" in item:
+                results.append(Exception(item["error"].get("reason", str(item["error"]))))
+            else:
+                results.append((group_buckets(item), item))
+        return results
+
+    async def search_page(self, query: str, data_type: str, size: int, pit_id: str, search_after: list,
+                          exact: bool, identifier) -> dict:
+        es = get_es().options(request_timeout=settings.ELASTICSEARCH_SEARCH_TIMEOUT)
+        keep_alive = settings.SEARCH_PIT_KEEP_ALIVE
+        first_page = pit_id is None
+        
+        try:
+            if first_page:
+                pit = await es.open_point_in_time(
+                    index=settings.ELASTICSEARCH_INDEX, keep_alive=keep_alive, routing=type_routing(data_type)
+                )
+                pit_id = pit["id"]
+            
+            def body(clause):
+                request = {
+                    "query": clause,
+                    "size": size,
+                    "pit": {"id": pit_id, "keep_alive": keep_alive},
+                    "sort": [{"_score": "desc"}, {"_shard_doc": "asc"}],
+                    "track_total_hits": first_page
+                }
+                if search_after:
+                    request["search_after"] = search_after
+                return request
+            
+            response = None
+            if exact:
+                response = await es.search(body=body(build_exact_clause(identifier[1], data_type)))
+                if first_page and not response["hits"]["hits"]:
+                    # Same fallback as search_data: no exact match, page the full query
+                    exact = False
+                    response = None
+            if response is None:
+                response = await es.search(body=body(build_search_clause(query, data_type)))
+            
+            hits = response["hits"]["hits"]
+            pit_id = response.get("pit_id", pit_id)
+            next_after = hits[-1]["sort"] if len(hits) == size else None
+            if next_after is None:
+                await close_point_in_time(pit_id)
+            
+            return {
+                "results": [format_hit(hit) for hit in hits],
+                "total": response["hits"]["total"]["value"] if first_page else None,
+                "pit_id": pit_id if next_after is not None else None,
+                "search_after": next_after,
+                "exact": exact
+            }
+        except NotFoundError as e:
+            if first_page:
+                logger.error(f"Search page error: {e}")
+                raise
+            raise PointInTimeExpired(str(e)) from e
+        except Exception as e:
+            logger.error(f"Search page error: {e}")
+            raise
+
+    async def scan_documents(self):
+        from elasticsearch.helpers import async_scan
+        async for hit in async_scan(
+            get_es().options(request_timeout=settings.ELASTICSEARCH_BULK_TIMEOUT),
+            index=settings.ELASTICSEARCH_INDEX,
+            query={"query": {"match_all": {}}, "_source": ["type", "value", "value_norm"]},
+            size=5000
+        ):
+            yield hit["_source"]
+
+    async def stats(self) -> dict:
+        try:
+            stats = await get_es().indices.stats(index=settings.ELASTICSEARCH_INDEX)
+            return {
+                "total_documents": stats["_all"]["primaries"]["docs"]["count"],
+                "index": ", ".join(stats["indices"]),
+            }
+        except Exception as e:
+            logger.error(f"Error getting stats: {e}")
+            return {}
+
+
+elasticsearch_backend = ElasticsearchBackend()
+
+
+async def rebuild_bloom_filters():
+    """
+    Rebuild the Bloom filters from every indexed document and mark them complete.
+    The rebuild holds a writer marker, so readers reject nothing until it is saved,
+    and the save merges the values imports started meanwhile have saved.
+    """
+    bloom = get_bloom_index()
+    bloom.reset()
+    count = 0
+    async with bloom.writing():
+        async for doc in get_backend().scan_documents():
+            bloom.add(doc["type"], doc.get("value_norm") or normalize_value(doc["type"], str(doc["value"])))
+            count += 1
+        bloom.complete = True
+    logger.info(f"Rebuilt Bloom filters from {count} documents")
+    return count
+
+
+async def get_index_stats():
+    """Get statistics about the search index."""
+    return await get_backend().stats()
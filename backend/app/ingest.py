@@ -0,0 +1,450 @@
+"""
+Streaming readers and document building, shared by the admin uploader and the CLI importer.
+
+Every reader yields DataFrame chunks of at most chunk_rows rows, so memory use
+is bounded by the chunk size rather than the file size. Documents are built
+column-wise per chunk and handed out lazily.
+
+Supported formats: CSV and NDJSON (optionally gzip or zstd compressed), XLSX,
+XLS, Parquet and Arrow IPC (file or stream). The format is recognized from the
+file's magic bytes, then its extension; Parquet and Arrow need pyarrow and
+zstd needs zstandard.
+"""
+import asyncio
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+from datetime import datetime
+from typing import AsyncIterator, Callable, Iterator
+
+import numpy as np
+import pandas as pd
+
+from app.normalizers import normalize_series, normalize_value
+
+DEFAULT_CHUNK_ROWS = 10000
+REQUIRED_COLUMNS = ['type', 'value']
+OPTIONAL_COLUMNS = ['source', 'additional_info']
+DOCUMENT_FIELDS = ['type', 'value', 'value_norm', 'source', 'additional_info']
+ARROW_FILE_MAGIC = b"ARROW1"
+# Separators and punctuation, which carry no content of their own
+NON_CONTENT_RE = re.compile(r"[\W_]+")
+
+
+def open_text(path: str, compression: str = None):
+    """Open a possibly gzip or zstd compressed text file for reading."""
+    if compression == "gzip":
+        return gzip.open(path, "rt", encoding="utf-8")
+    if compression == "zstd":
+        import zstandard
+
+        stream = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def iter_csv(path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS, compression: str = None) -> Iterator[pd.DataFrame]:
+    # dtype=str keeps identifiers such as phone numbers exactly as written
+    yield from pd.read_csv(path, chunksize=chunk_rows, dtype=str, keep_default_na=False, compression=compression)
+
+
+def ndjson_frames(lines, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    batch = []
+    for line in lines:
+        if line.strip():
+            batch.append(json.loads(line))
+        if len(batch) >= chunk_rows:
+            # dtype=object keeps numbers as written instead of floats padded with NaN
+            yield pd.DataFrame(batch, dtype=object)
+            batch = []
+    if batch:
+        yield pd.DataFrame(batch, dtype=object)
+
+
+def iter_ndjson(path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS, compression: str = None) -> Iterator[pd.DataFrame]:
+    """One JSON object per line; blank lines are skipped."""
+    with open_text(path, compression) as f:
+        yield from ndjson_frames(f, chunk_rows)
+
+
+def iter_xlsx(path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Stream the first sheet row by row with openpyxl's read-only mode."""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(cell).strip() if cell is not None else f"column_{i}" for i, cell in enumerate(header)]
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= chunk_rows:
+                yield pd.DataFrame(batch, columns=columns).fillna("")
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns).fillna("")
+    finally:
+        workbook.close()
+
+
+def iter_xls(path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Legacy .xls has no streaming reader; load it and hand it out in chunks."""
+    df = pd.read_excel(path, dtype=str).fillna("")
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def arrow_frame(batch) -> pd.DataFrame:
+    """Convert a record batch to a DataFrame of strings, so numeric identifiers keep their digits."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    columns = []
+    for column in batch.columns:
+        if not pa.types.is_string(column.type):
+            try:
+                column = pc.cast(column, pa.string())
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                pass
+        columns.append(column)
+    return pa.RecordBatch.from_arrays(columns, names=batch.schema.names).to_pandas().fillna("")
+
+
+def document_columns(names: list) -> list:
+    """The columns of a columnar file that documents are built from; the rest are never read."""
+    return [name for name in REQUIRED_COLUMNS + OPTIONAL_COLUMNS if name in names]
+
+
+def iter_parquet(path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS, row_groups: list = None) -> Iterator[pd.DataFrame]:
+    """Read the whole file, or only the given row groups."""
+    import pyarrow.parquet as pq
+
+    parquet = pq.ParquetFile(path)
+    columns = document_columns(parquet.schema_arrow.names)
+    for batch in parquet.iter_batches(batch_size=chunk_rows, row_groups=row_groups, columns=columns):
+        yield arrow_frame(batch)
+
+
+def iter_arrow(path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS, record_batches: list = None) -> Iterator[pd.DataFrame]:
+    """
+    Arrow IPC file (Feather v2) or stream, memory-mapped and read a record batch at a time.
+    record_batches picks batches of an IPC file by index.
+    """
+    import pyarrow as pa
+
+    source = pa.memory_map(path)
+    try:
+        if source.read(6) == ARROW_FILE_MAGIC:
+            reader = pa.ipc.open_file(source)
+            indices = range(reader.num_record_batches) if record_batches is None else record_batches
+            batches = (reader.get_batch(i) for i in indices)
+        else:
+            source.seek(0)
+            reader = pa.ipc.open_stream(source)
+            batches = iter(reader)
+        columns = document_columns(reader.schema.names)
+        for batch in batches:
+            batch = batch.select(columns)
+            for start in range(0, batch.num_rows, chunk_rows):
+                yield arrow_frame(batch.slice(start, chunk_rows))
+    finally:
+        source.close()
+
+
+READERS = {
+    "csv": iter_csv,
+    "ndjson": iter_ndjson,
+    "xlsx": iter_xlsx,
+    "xls": iter_xls,
+    "parquet": iter_parquet,
+    "arrow": iter_arrow,
+}
+TEXT_FORMATS = ["csv", "ndjson"]  # the formats read through a decompressor
+EXTENSIONS = {
+    ".csv": "csv",
+    ".txt": "csv",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+    ".json": "ndjson",
+    ".xlsx": "xlsx",
+    ".xls": "xls",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".ipc": "arrow",
+}
+COMPRESSION_EXTENSIONS = {".gz": "gzip", ".gzip": "gzip", ".zst": "zstd", ".zstd": "zstd"}
+MAGIC_BYTES = [
+    (b"PAR1", "parquet"),
+    (ARROW_FILE_MAGIC, "arrow"),
+    (b"\xff\xff\xff\xff", "arrow"),  # IPC stream continuation marker
+    (b"PK\x03\x04", "xlsx"),
+    (b"\xd0\xcf\x11\xe0", "xls"),
+]
+COMPRESSION_MAGIC = [(b"\x1f\x8b", "gzip"), (b"\x28\xb5\x2f\xfd", "zstd")]
+
+
+def detect_format(path: str, filename: str = None):
+    """
+    Return (format, compression) for a file. Magic bytes win over the extension,
+    which is the only way to tell CSV from NDJSON; without a known extension a
+    first line starting with '{' means NDJSON. compression is gzip, zstd or None.
+    """
+    name = (filename or path).lower()
+    stem, extension = os.path.splitext(name)
+    compression = COMPRESSION_EXTENSIONS.get(extension)
+    if compression:
+        extension = os.path.splitext(stem)[1]
+    with open(path, "rb") as f:
+        head = f.read(8)
+    for magic, magic_compression in COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            compression = magic_compression
+    if compression is None:
+        for magic, fmt in MAGIC_BYTES:
+            if head.startswith(magic):
+                return fmt, None
+    if extension in EXTENSIONS and EXTENSIONS[extension] in (TEXT_FORMATS if compression else READERS):
+        return EXTENSIONS[extension], compression
+    with open_text(path, compression) as f:
+        first = f.readline().lstrip()
+    return ("ndjson" if first.startswith("{") else "csv"), compression
+
+
+def iter_chunks(path: str, filename: str = None, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Detect the file's format and stream it in chunks."""
+    fmt, compression = detect_format(path, filename)
+    if compression:
+        yield from READERS[fmt](path, chunk_rows, compression=compression)
+    else:
+        yield from READERS[fmt](path, chunk_rows)
+
+
+class ByteRange(io.RawIOBase):
+    """Read-only view of bytes [start, end) of a file."""
+
+    def __init__(self, path: str, start: int, end: int):
+        super().__init__()
+        self._file = open(path, "rb")
+        self._file.seek(start)
+        self._remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self._remaining)
+        if size <= 0:
+            return 0
+        read = self._file.readinto(memoryview(buffer)[:size])
+        self._remaining -= read
+        return read
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def line_ranges(path: str, start: int, count: int) -> list:
+    """Split bytes [start, end of file) into up to count ranges that begin at a line start."""
+    size = os.path.getsize(path)
+    bounds = [start]
+    with open(path, "rb") as f:
+        for k in range(1, count):
+            target = start + (size - start) * k // count
+            if target <= bounds[-1]:
+                continue
+            # Seeking one byte back finds target itself when a line starts there
+            f.seek(target - 1)
+            f.readline()
+            bounds.append(f.tell())
+    bounds.append(size)
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if a < b]
+
+
+def split_parts(count_parts: int, count: int) -> list:
+    """Split indices 0..count_parts-1 into up to count contiguous lists."""
+    return [
+        list(range(i * count_parts // count, (i + 1) * count_parts // count))
+        for i in range(count)
+        if (i + 1) * count_parts // count > i * count_parts // count
+    ]
+
+
+def has_quoted_newlines(path: str, block_size: int = 4 * 1024 * 1024) -> bool:
+    """Whether a CSV file has a line break inside a quoted value."""
+    inside = 0  # odd while a quoted value is open
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            data = np.frombuffer(block, dtype=np.uint8)
+            # Escaped quotes ("") come in pairs, so the parity of the quotes seen says if one is open;
+            # the uint8 sum wraps around at 256, which keeps the parity
+            state = (np.cumsum(data == ord('"'), dtype=np.uint8) + inside) & 1
+            if np.any(state[data == ord("\n")]):
+                return True
+            inside = int(state[-1])
+    return False
+
+
+def plan_shards(path: str, filename: str = None, count: int = 1) -> list:
+    """
+    Split a file into up to count shards that can be read independently:
+    line-aligned byte ranges of uncompressed CSV and NDJSON, row groups of Parquet
+    and record batches of Arrow IPC files. Any other file is a single shard, as is
+    a CSV with line breaks inside quoted values, which a byte range could cut.
+    """
+    fmt, compression = detect_format(path, filename)
+    whole = [{"format": fmt, "compression": compression}]
+    if count <= 1 or compression:
+        return whole
+    if fmt == "csv" and not has_quoted_newlines(path):
+        columns = pd.read_csv(path, nrows=0).columns.tolist()
+        with open(path, "rb") as f:
+            f.readline()
+            body = f.tell()
+        return [{"format": fmt, "start": a, "end": b, "columns": columns} for a, b in line_ranges(path, body, count)]
+    if fmt == "ndjson":
+        return [{"format": fmt, "start": a, "end": b} for a, b in line_ranges(path, 0, count)]
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        groups = pq.ParquetFile(path).num_row_groups
+        return [{"format": fmt, "parts": parts} for parts in split_parts(groups, count)] or whole
+    if fmt == "arrow":
+        import pyarrow as pa
+
+        with pa.memory_map(path) as source:
+            if source.read(6) != ARROW_FILE_MAGIC:
+                return whole  # an IPC stream can only be read front to back
+            batches = pa.ipc.open_file(source).num_record_batches
+        return [{"format": fmt, "parts": parts} for parts in split_parts(batches, count)] or whole
+    return whole
+
+
+def iter_shard_chunks(path: str, shard: dict, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Stream one shard from plan_shards in chunks."""
+    fmt = shard["format"]
+    if fmt == "csv" and "start" in shard:
+        with io.BufferedReader(ByteRange(path, shard["start"], shard["end"])) as f:
+            yield from pd.read_csv(
+                f, names=shard["columns"], header=None, chunksize=chunk_rows, dtype=str, keep_default_na=False
+            )
+    elif fmt == "ndjson" and "start" in shard:
+        with io.TextIOWrapper(io.BufferedReader(ByteRange(path, shard["start"], shard["end"])), encoding="utf-8") as f:
+            yield from ndjson_frames(f, chunk_rows)
+    elif fmt == "parquet" and "parts" in shard:
+        yield from iter_parquet(path, chunk_rows, row_groups=shard["parts"])
+    elif fmt == "arrow" and "parts" in shard:
+        yield from iter_arrow(path, chunk_rows, record_batches=shard["parts"])
+    elif shard.get("compression"):
+        yield from READERS[fmt](path, chunk_rows, compression=shard["compression"])
+    else:
+        yield from READERS[fmt](path, chunk_rows)
+
+
+def file_checksum(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def content_length(value: str) -> int:
+    """Letters and digits in value, ignoring leading zeros (trunk and 00 prefixes)."""
+    return len(NON_CONTENT_RE.sub("", value).lstrip("0"))
+
+
+def identity_value(value: str, value_norm: str) -> str:
+    """
+    The value a document's _id is derived from: value_norm, unless normalizing dropped
+    part of the value, as for masked or junk input ("98XXXXXX10", "N/A"); such values
+    would share an _id with unrelated ones, so the raw value is used instead.
+    """
+    value = value.strip()
+    if content_length(value_norm) < content_length(value):
+        return value.lower()
+    return value_norm
+
+
+def document_id(doc: dict) -> str:
+    """Stable _id from normalized (type, value, source), so re-imports overwrite instead of duplicating."""
+    value = str(doc["value"])
+    value_norm = doc.get("value_norm") or normalize_value(doc["type"], value)
+    source = str(doc.get("source") or "").strip().lower()
+    key = "\x1f".join([doc["type"], identity_value(value, value_norm), source])
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+def prepare_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Validate a chunk and return its document columns as normalized strings."""
+    for col in REQUIRED_COLUMNS:
+        if col not in df.columns:
+            raise ValueError(f"Missing required column: {col}")
+    frame = pd.DataFrame(index=df.index)
+    for col in REQUIRED_COLUMNS + OPTIONAL_COLUMNS:
+        if col in df.columns:
+            frame[col] = df[col].fillna("").astype(str)
+        else:
+            frame[col] = ""
+    frame['type'] = frame['type'].str.lower()
+    frame['value_norm'] = ""
+    # One vectorized pass per data type instead of a call per row
+    for dtype, index in frame.groupby('type', sort=False).groups.items():
+        frame.loc[index, 'value_norm'] = normalize_series(dtype, frame.loc[index, 'value']).values
+    return frame[DOCUMENT_FIELDS]
+
+
+def frame_documents(frame: pd.DataFrame, indexed_at: str = None) -> Iterator[dict]:
+    """Yield the documents of a prepare_frame() result lazily, with one shared timestamp."""
+    indexed_at = indexed_at or datetime.utcnow().isoformat()
+    return (
+        dict(zip(DOCUMENT_FIELDS, row), indexed_at=indexed_at)
+        for row in frame.itertuples(index=False, name=None)
+    )
+
+
+def iter_documents(df: pd.DataFrame, indexed_at: str = None) -> Iterator[dict]:
+    """Validate and normalize a chunk up front, then yield its documents lazily with one shared timestamp."""
+    return frame_documents(prepare_frame(df), indexed_at)
+
+
+def document_keys(frame: pd.DataFrame) -> list:
+    """document_id of every row of a prepare_frame() result, as 16 raw bytes."""
+    sources = frame['source'].str.strip().str.lower()
+    values = map(identity_value, frame['value'], frame['value_norm'])
+    return [
+        hashlib.blake2b("\x1f".join(key).encode(), digest_size=16).digest()
+        for key in zip(frame['type'], values, sources)
+    ]
+
+
+def build_documents(df: pd.DataFrame) -> list:
+    return list(iter_documents(df))
+
+
+async def aiter_file_documents(
+    path: str,
+    filename: str = None,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    on_chunk: Callable[[int], None] = None,
+    shard: dict = None,
+) -> AsyncIterator[dict]:
+    """Yield the documents of a file (or of one shard of it), parsing each chunk off the event loop."""
+    chunks = iter_shard_chunks(path, shard, chunk_rows) if shard else iter_chunks(path, filename, chunk_rows)
+    while True:
+        df = await asyncio.to_thread(next, chunks, None)
+        if df is None:
+            return
+        documents = frame_documents(await asyncio.to_thread(prepare_frame, df))
+        if on_chunk is not None:
+            on_chunk(len(df))
+        for doc in documents:
+            yield doc
@@ -0,0 +1,422 @@
+"""
+Background upload and enrichment jobs, persisted in the ingest_jobs table.
+
+A job's file is spooled to UPLOAD_DIR and processed a chunk of rows at a
+time. Once every row of a chunk has been indexed (or matched), the row offset
+and counters are checkpointed, so after a restart resume_jobs() continues each
+unfinished job from its last checkpoint. Rows of a chunk that was cut short
+are simply sent again: document IDs are deterministic, so that is harmless.
+
+Jobs wait in a priority queue (FIFO within a priority) drained by
+JOB_WORKERS worker tasks, so a burst of uploads queues up instead of running
+all at once. A pause or cancel of a running job is recorded in its control
+column and honoured at the next checkpoint: a paused job keeps its file and
+continues from the checkpoint when resumed, a cancelled one drops it (rows
+already indexed stay). Status changes are conditional updates, so a job is
+only started, paused or cancelled once even with several API processes.
+
+A running job refreshes its heartbeat; jobs whose heartbeat is older than
+JOB_LEASE_SECONDS are taken over by the next process that starts, and only
+one process can claim them.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import socket
+import uuid
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from app.bloom import get_bloom_index
+from app.config import settings
+from app.database import SessionLocal
+from app.elasticsearch_client import bulk_index_data, bulk_load_mode, delete_documents, msearch_data, DATA_TYPES
+from app.ingest import file_checksum, frame_documents, iter_chunks, prepare_frame
+from app.manifest import ManifestRun, dead_letter_ids
+from app.models import IngestJob, SearchLog
+from app.search import charge_searches, format_search_response
+
+logger = logging.getLogger(__name__)
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+COUNTERS = ["processed", "failed", "created", "updated", "unchanged", "deleted", "matched"]
+STATUS_FIELDS = {
+    "upload": ["kind", "owner_id", "status", "priority", "total", "processed", "failed", "created", "updated", "unchanged",
+               "deleted", "dead_letter", "error"],
+    "enrich": ["kind", "owner_id", "status", "priority", "total", "processed", "matched", "failed", "error"],
+}
+
+_queue = None  # (-priority, sequence, job_id), created with the workers on first use
+_sequence = itertools.count()
+_workers = []
+
+
+class SearchLimitReached(Exception):
+    """The owner of an enrichment job ran out of searches."""
+
+
+class JobInterrupted(Exception):
+    """Raised at a checkpoint when a pause or cancel of the job was requested."""
+
+    def __init__(self, action: str):
+        super().__init__(action)
+        self.action = action
+
+
+def new_job_id() -> str:
+    return f"job_{uuid.uuid4().hex}"
+
+
+def create_job(job_id: str, kind: str, owner_id: int, filename: str, file_path: str, checksum: str,
+               options: dict = None, priority: int = 0):
+    db = SessionLocal()
+    try:
+        db.add(IngestJob(
+            id=job_id,
+            kind=kind,
+            owner_id=owner_id,
+            status="queued",
+            filename=filename,
+            file_path=file_path,
+            checksum=checksum,
+            options=options or {},
+            priority=priority,
+            worker_id=WORKER_ID,
+            heartbeat_at=datetime.utcnow(),
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+
+def get_job(job_id: str):
+    db = SessionLocal()
+    try:
+        return db.get(IngestJob, job_id)
+    finally:
+        db.close()
+
+
+def update_job(job_id: str, **fields):
+    """Persist fields of a job (a checkpoint) and refresh its heartbeat."""
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        db.query(IngestJob).filter(IngestJob.id == job_id).update(
+            {**fields, "heartbeat_at": now, "updated_at": now}
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def transition_job(job_id: str, from_statuses: list, **fields) -> bool:
+    """Update a job only if its status is one of from_statuses; True if it was."""
+    db = SessionLocal()
+    try:
+        rows = db.query(IngestJob).filter(IngestJob.id == job_id, IngestJob.status.in_(from_statuses)).update(
+            {**fields, "updated_at": datetime.utcnow()}, synchronize_session=False
+        )
+        db.commit()
+        return rows > 0
+    finally:
+        db.close()
+
+
+def list_jobs(status: str = None, limit: int = 50) -> list:
+    db = SessionLocal()
+    try:
+        query = db.query(IngestJob)
+        if status:
+            query = query.filter(IngestJob.status == status)
+        return query.order_by(IngestJob.created_at.desc()).limit(limit).all()
+    finally:
+        db.close()
+
+
+def job_status(job: IngestJob) -> dict:
+    """The /upload-status view of a job."""
+    status = {field: getattr(job, field) for field in STATUS_FIELDS[job.kind] if getattr(job, field) is not None}
+    if job.status == "running" and job.control:
+        status["status"] = "pausing" if job.control == "pause" else "cancelling"
+    if job.kind == "enrich" and (job.status == "completed" or job.status == "failed" and job.matched):
+        # A job stopped by the search limit keeps the matches it paid for
+        status["result_file"] = f"/admin/enrich/{job.id}/download"
+    return status
+
+
+def result_path(job_id: str) -> str:
+    return os.path.join(settings.JOB_RESULTS_DIR, f"{job_id}.ndjson")
+
+
+def submit_job(job_id: str, priority: int = 0):
+    """Queue a job for the worker pool, starting the JOB_WORKERS workers on first use."""
+    global _queue
+    if _queue is None:
+        _queue = asyncio.PriorityQueue()
+        _workers.extend(asyncio.create_task(_worker()) for _ in range(max(1, settings.JOB_WORKERS)))
+    _queue.put_nowait((-(priority or 0), next(_sequence), job_id))
+
+
+async def _worker():
+    while True:
+        _, _, job_id = await _queue.get()
+        try:
+            await run_job(job_id)
+        except Exception as e:
+            logger.error(f"Job {job_id} crashed: {e}")
+        finally:
+            _queue.task_done()
+
+
+def check_control(job_id: str):
+    """Raise JobInterrupted if a pause or cancel was requested for the job."""
+    job = get_job(job_id)
+    if job is not None and job.control:
+        raise JobInterrupted(job.control)
+
+
+def remove_job_files(job: IngestJob):
+    paths = [job.file_path]
+    if job.kind == "enrich":
+        paths.append(result_path(job.id))
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+async def _heartbeat(job_id: str):
+    while True:
+        await asyncio.sleep(settings.JOB_LEASE_SECONDS / 3)
+        update_job(job_id)
+
+
+async def run_job(job_id: str):
+    # Paused, cancelled or already taken by another worker while it waited in the queue
+    if not transition_job(job_id, ["queued"], status="running", worker_id=WORKER_ID, heartbeat_at=datetime.utcnow()):
+        return
+    job = get_job(job_id)
+    heartbeat = asyncio.create_task(_heartbeat(job_id))
+    try:
+        check_control(job_id)
+        if job.checksum and await asyncio.to_thread(file_checksum, job.file_path) != job.checksum:
+            raise ValueError("Uploaded file changed since the job was created")
+        runner = run_enrich if job.kind == "enrich" else run_upload
+        await runner(job)
+        update_job(job_id, status="completed", control=None)
+    except JobInterrupted as e:
+        if e.action == "pause":
+            update_job(job_id, status="paused", control=None)
+            logger.info(f"Job {job_id} paused")
+            return
+        update_job(job_id, status="cancelled", control=None)
+        logger.info(f"Job {job_id} cancelled")
+        remove_job_files(job)
+        return
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {e}")
+        update_job(job_id, status="failed", error=str(e))
+    finally:
+        heartbeat.cancel()
+    # Only finished jobs drop their file; an interrupted one resumes from it
+    if job.file_path and os.path.exists(job.file_path):
+        os.remove(job.file_path)
+
+
+def cancel_job(job_id: str) -> str:
+    """Cancel a job; returns its new status, or None if it has already ended."""
+    if transition_job(job_id, ["queued", "paused"], status="cancelled"):
+        remove_job_files(get_job(job_id))
+        return "cancelled"
+    if transition_job(job_id, ["running"], control="cancel"):
+        return "cancelling"
+    return None
+
+
+def pause_job(job_id: str) -> str:
+    """Pause a job; returns its new status, or None if it can't be paused."""
+    if transition_job(job_id, ["queued"], status="paused"):
+        return "paused"
+    if transition_job(job_id, ["running"], control="pause"):
+        return "pausing"
+    return None
+
+
+def resume_job(job_id: str) -> bool:
+    """Queue a paused job again; it continues from its last checkpoint."""
+    if not transition_job(job_id, ["paused"], status="queued", control=None):
+        return False
+    submit_job(job_id, get_job(job_id).priority)
+    return True
+
+
+async def iter_pending_chunks(job: IngestJob, chunk_rows: int):
+    """Yield (rows read so far, chunk) for the rows after the job's checkpoint."""
+    chunks = iter_chunks(job.file_path, job.filename, chunk_rows)
+    seen = 0
+    next_chunk = asyncio.ensure_future(asyncio.to_thread(next, chunks, None))
+    while True:
+        df = await next_chunk
+        if df is None:
+            return
+        # Parse the next chunk while the caller works on this one
+        next_chunk = asyncio.ensure_future(asyncio.to_thread(next, chunks, None))
+        start, seen = seen, seen + len(df)
+        if seen <= job.offset:
+            continue
+        if start < job.offset:
+            df = df.iloc[job.offset - start:]
+        yield seen, df
+
+
+async def run_upload(job: IngestJob):
+    options = job.options or {}
+    counts = {counter: getattr(job, counter) or 0 for counter in COUNTERS}
+    dead_letter_path = os.path.join(settings.DEAD_LETTER_DIR, f"{job.id}.ndjson")
+    if job.offset:
+        logger.info(f"Resuming job {job.id} after row {job.offset}")
+    # Delta import: the manifest run is the job, so a resumed job keeps the chunks it recorded
+    run = ManifestRun(options["manifest"], job.id) if options.get("manifest") else None
+    if run is not None and not job.offset and run.file_unchanged(job.checksum):
+        logger.info(f"Job {job.id}: file unchanged since the last import of manifest {options['manifest']}")
+        update_job(job.id, total=run.rows, unchanged=run.rows)
+        return
+    bulk_mode = bulk_load_mode(options.get("force_merge", False)) if options.get("bulk_mode") else nullcontext()
+    # One Bloom filter save for the whole job rather than one per chunk
+    async with bulk_mode, get_bloom_index().writing():
+        async for offset, df in iter_pending_chunks(job, settings.UPLOAD_CHUNK_ROWS):
+            # Raises on a missing required column, failing the job
+            if run is not None:
+                frame, unchanged = await asyncio.to_thread(run.filter_chunk, offset - len(df), df)
+                counts["unchanged"] += unchanged
+                documents = frame_documents(frame) if frame is not None else None
+            else:
+                # Normalizing a chunk is CPU work, keep it off the event loop the API serves
+                documents = frame_documents(await asyncio.to_thread(prepare_frame, df))
+            update_job(job.id, total=offset)
+            progress = {}
+            if documents is not None:
+                await bulk_index_data(documents, dead_letter_path, progress=progress, op_type=options.get("op_type"))
+            for counter in COUNTERS:
+                counts[counter] += progress.get(counter, 0)
+            update_job(
+                job.id, offset=offset, total=offset,
+                dead_letter=dead_letter_path if counts["failed"] else None, **counts
+            )
+            check_control(job.id)
+        if run is not None:
+            if options.get("delete_missing"):
+                counts["deleted"] += await delete_documents(run.missing_ids())
+            run.commit(job.checksum, dead_letter_ids(dead_letter_path) if counts["failed"] else None)
+            update_job(job.id, **counts)
+
+
+def log_searches(user_id: int, rows: list):
+    """Write SearchLog rows for (query, type, results count) tuples in one insert."""
+    if not rows:
+        return
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        db.execute(insert(SearchLog), [
+            {"user_id": user_id, "query": query, "data_type": dtype, "results_count": count, "timestamp": now}
+            for query, dtype, count in rows
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def count_rows(path: str, filename: str = None) -> int:
+    return sum(len(df) for df in iter_chunks(path, filename, settings.ENRICH_CHUNK_ROWS))
+
+
+async def run_enrich(job: IngestJob):
+    counts = {counter: getattr(job, counter) or 0 for counter in COUNTERS}
+    semaphore = asyncio.Semaphore(settings.ENRICH_CONCURRENCY)
+    path = result_path(job.id)
+    os.makedirs(settings.JOB_RESULTS_DIR, exist_ok=True)
+    if os.path.exists(path):
+        # Drop matches written after the last checkpoint, they are redone
+        os.truncate(path, job.result_offset)
+    elif not job.offset:
+        # Fail oversized files before any search is charged
+        rows = await asyncio.to_thread(count_rows, job.file_path, job.filename)
+        if rows > settings.ENRICH_MAX_ROWS:
+            raise ValueError(f"File has {rows} rows, at most {settings.ENRICH_MAX_ROWS} are allowed")
+
+    async def run_batch(pairs):
+        async with semaphore:
+            grouped = await msearch_data(pairs)
+        lines = []
+        logged = []
+        for (query, dtype), results in zip(pairs, grouped):
+            if isinstance(results, Exception):
+                counts["failed"] += 1
+                logged.append((query, dtype, 0))
+                continue
+            response = format_search_response(query, dtype, results)
+            logged.append((query, dtype, response["total_results"]))
+            if response["total_results"]:
+                lines.append(json.dumps(response) + "\n")
+        log_searches(job.owner_id, logged)
+        return lines
+
+    with open(path, "a") as out:
+        async for offset, chunk in iter_pending_chunks(job, settings.ENRICH_CHUNK_ROWS):
+            if 'value' not in chunk.columns:
+                raise ValueError("Missing column: value")
+            types = chunk['type'].str.lower() if 'type' in chunk.columns else [None] * len(chunk)
+            pairs = [
+                (str(value).strip(), dtype if dtype in DATA_TYPES else None)
+                for value, dtype in zip(chunk['value'], types)
+                if len(str(value).strip()) >= 2
+            ]
+            batches = [pairs[i:i + settings.ENRICH_BATCH_SIZE] for i in range(0, len(pairs), settings.ENRICH_BATCH_SIZE)]
+            # Every identifier costs a search; stop at the first batch the owner can't pay for
+            paid = []
+            for batch in batches:
+                if not charge_searches(job.owner_id, len(batch)):
+                    break
+                paid.append(batch)
+            for lines in await asyncio.gather(*(run_batch(batch) for batch in paid)):
+                out.writelines(lines)
+                counts["matched"] += len(lines)
+            counts["processed"] += sum(len(batch) for batch in paid)
+            out.flush()
+            if len(paid) < len(batches):
+                update_job(job.id, result_offset=out.tell(), **counts)
+                raise SearchLimitReached(f"Search limit reached after {counts['processed']} identifiers")
+            counts["failed"] += len(chunk) - len(pairs)
+            update_job(job.id, offset=offset, total=offset, result_offset=out.tell(), **counts)
+            check_control(job.id)
+
+
+def resume_jobs() -> int:
+    """Claim unfinished jobs whose owner stopped checkpointing and queue them again."""
+    stale = datetime.utcnow() - timedelta(seconds=settings.JOB_LEASE_SECONDS)
+    db = SessionLocal()
+    try:
+        candidates = db.query(IngestJob).filter(
+            IngestJob.status.in_(["queued", "running"]),
+            (IngestJob.heartbeat_at < stale) | (IngestJob.worker_id == WORKER_ID) | (IngestJob.heartbeat_at.is_(None)),
+        ).order_by(IngestJob.created_at).all()
+        claimed = []
+        for job in candidates:
+            # Conditional update: if another process claimed it first, no row matches
+            rows = db.query(IngestJob).filter(
+                IngestJob.id == job.id, IngestJob.worker_id == job.worker_id, IngestJob.heartbeat_at == job.heartbeat_at
+            ).update({"status": "queued", "worker_id": WORKER_ID, "heartbeat_at": datetime.utcnow()})
+            db.commit()
+            if rows:
+                claimed.append((job.id, job.priority))
+    finally:
+        db.close()
+    for job_id, priority in claimed:
+        logger.info(f"Resuming job {job_id}")
+        submit_job(job_id, priority)
+    return len(claimed)
@@ -0,0 +1,538 @@
+"""
+Embedded on-disk search index, used when Elasticsearch is unavailable.
+
+The index is a directory of immutable segments. Each segment holds the
+documents as JSON lines plus numpy arrays that are memory-mapped on open:
+
+    values.bin / values_idx   lowercased values, for verifying candidates
+    types.npy                 data type code per document
+    gram_keys / gram_ptr / gram_post
+                              2-gram and 3-gram postings, sorted doc ids per gram
+    norm_keys / norm_docs     hash of (type, value_norm) -> doc id, sorted by hash
+
+Substring and phrase candidates come from intersecting gram postings, fuzzy
+candidates from gram overlap counts, and exact identifiers from the norm hash.
+Every candidate is verified against its value before it counts as a match.
+
+segments.json lists the live segments. Writers (the API and import_data.py)
+take turns through a lock file to add segments, merge them and delete the
+merged ones; readers reopen the index whenever the list changes.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are not serialized across processes
+    fcntl = None
+
+from app.bulk import aiter_batches, ingest_limiter
+from app.config import settings
+from app.normalizers import DATA_TYPES, normalize_value
+
+logger = logging.getLogger(__name__)
+
+BIGRAM_FLAG = 1 << 24
+UNKNOWN_TYPE = 255
+TIER_SCORES = {"exact": 4.0, "phrase": 3.0, "substring": 2.0, "fuzzy": 1.0}
+FUZZY_MAX_EDITS = 2  # as the ES fuzzy tier
+MANIFEST = "segments.json"
+
+
+def type_code(data_type: str) -> int:
+    return DATA_TYPES.index(data_type) if data_type in DATA_TYPES else UNKNOWN_TYPE
+
+
+def norm_hash(data_type: str, value_norm: str) -> int:
+    digest = hashlib.blake2b(f"{data_type}\0{value_norm}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def trigrams(text: bytes):
+    return sorted({text[i] << 16 | text[i + 1] << 8 | text[i + 2] for i in range(len(text) - 2)})
+
+
+def bigrams(text: bytes):
+    return sorted({BIGRAM_FLAG | text[i] << 8 | text[i + 1] for i in range(len(text) - 1)})
+
+
+def query_grams(text: bytes):
+    """Grams used to look a query up: trigrams, or bigrams for 2-byte queries."""
+    if len(text) >= 3:
+        return trigrams(text)
+    return bigrams(text)
+
+
+def within_edits(a: str, b: str, max_edits: int = 2) -> bool:
+    """Levenshtein distance <= max_edits, with early exit."""
+    if abs(len(a) - len(b)) > max_edits:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > max_edits:
+            return False
+        previous = current
+    return previous[-1] <= max_edits
+
+
+def write_segment(path: str, documents: list):
+    """Write documents as a new immutable segment directory at path."""
+    tmp_path = f"{path}.tmp"
+    os.makedirs(tmp_path)
+    count = len(documents)
+
+    values = [str(doc["value"]).lower().encode() for doc in documents]
+    lengths = np.fromiter((len(v) for v in values), dtype=np.int64, count=count)
+    value_idx = np.zeros(count + 1, dtype=np.uint64)
+    value_idx[1:] = np.cumsum(lengths)
+    with open(os.path.join(tmp_path, "values.bin"), "wb") as out:
+        out.write(b"".join(values))
+    np.save(os.path.join(tmp_path, "values_idx.npy"), value_idx)
+
+    doc_idx = np.zeros(count + 1, dtype=np.uint64)
+    with open(os.path.join(tmp_path, "docs.jsonl"), "wb") as out:
+        for i, doc in enumerate(documents):
+            line = json.dumps(doc).encode() + b"\n"
+            out.write(line)
+            doc_idx[i + 1] = doc_idx[i] + len(line)
+    np.save(os.path.join(tmp_path, "docs_idx.npy"), doc_idx)
+
+    np.save(
+        os.path.join(tmp_path, "types.npy"),
+        np.fromiter((type_code(doc["type"]) for doc in documents), dtype=np.uint8, count=count)
+    )
+
+    # Gram postings, computed over the concatenated values in one pass
+    blob = np.frombuffer(b"".join(values), dtype=np.uint8).astype(np.uint32)
+    doc_of_byte = np.repeat(np.arange(count, dtype=np.uint64), lengths)
+    trigram_ok = doc_of_byte[:-2] == doc_of_byte[2:]
+    bigram_ok = doc_of_byte[:-1] == doc_of_byte[1:]
+    grams = np.concatenate([
+        (blob[:-2] << 16 | blob[1:-1] << 8 | blob[2:])[trigram_ok],
+        (BIGRAM_FLAG | blob[:-1] << 8 | blob[1:])[bigram_ok],
+    ]).astype(np.uint64)
+    gram_docs = np.concatenate([doc_of_byte[:-2][trigram_ok], doc_of_byte[:-1][bigram_ok]])
+    pairs = np.unique(grams << np.uint64(32) | gram_docs)
+    gram_keys, gram_counts = np.unique(pairs >> np.uint64(32), return_counts=True)
+    gram_ptr = np.zeros(len(gram_keys) + 1, dtype=np.uint64)
+    np.cumsum(gram_counts, out=gram_ptr[1:])
+    np.save(os.path.join(tmp_path, "gram_keys.npy"), gram_keys.astype(np.uint32))
+    np.save(os.path.join(tmp_path, "gram_ptr.npy"), gram_ptr)
+    np.save(os.path.join(tmp_path, "gram_post.npy"), (pairs & np.uint64(0xFFFFFFFF)).astype(np.uint32))
+
+    hashes = np.fromiter(
+        (
+            norm_hash(doc["type"], doc.get("value_norm") or normalize_value(doc["type"], str(doc["value"])))
+            for doc in documents
+        ),
+        dtype=np.uint64,
+        count=count
+    )
+    order = np.argsort(hashes, kind="stable")
+    np.save(os.path.join(tmp_path, "norm_keys.npy"), hashes[order])
+    np.save(os.path.join(tmp_path, "norm_docs.npy"), order.astype(np.uint32))
+
+    with open(os.path.join(tmp_path, "meta.json"), "w") as out:
+        json.dump({"count": count, "created_at": time.time()}, out)
+    os.rename(tmp_path, path)
+
+
+class Segment:
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.count = json.load(f)["count"]
+
+        def load(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+        self.values_idx = load("values_idx")
+        self.docs_idx = load("docs_idx")
+        self.types = load("types")
+        self.gram_keys = load("gram_keys")
+        self.gram_ptr = load("gram_ptr")
+        self.gram_post = load("gram_post")
+        self.norm_keys = load("norm_keys")
+        self.norm_docs = load("norm_docs")
+        self.values = self._map("values.bin")
+        self.docs = self._map("docs.jsonl")
+
+    def _map(self, name):
+        with open(os.path.join(self.path, name), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def value(self, doc_id: int) -> str:
+        return self.values[int(self.values_idx[doc_id]):int(self.values_idx[doc_id + 1])].decode(errors="replace")
+
+    def document(self, doc_id: int) -> dict:
+        return json.loads(self.docs[int(self.docs_idx[doc_id]):int(self.docs_idx[doc_id + 1])])
+
+    def postings(self, gram: int):
+        k = int(np.searchsorted(self.gram_keys, gram))
+        if k < len(self.gram_keys) and self.gram_keys[k] == gram:
+            return self.gram_post[int(self.gram_ptr[k]):int(self.gram_ptr[k + 1])]
+        return np.empty(0, dtype=np.uint32)
+
+    def exact(self, data_type: str, value_norm: str):
+        h = np.uint64(norm_hash(data_type, value_norm))
+        lo = int(np.searchsorted(self.norm_keys, h, side="left"))
+        hi = int(np.searchsorted(self.norm_keys, h, side="right"))
+        return np.asarray(self.norm_docs[lo:hi])
+
+    def all_of(self, grams):
+        """Docs containing every gram, smallest posting list first."""
+        lists = sorted((self.postings(g) for g in grams), key=len)
+        if not lists:
+            return np.empty(0, dtype=np.uint32)
+        result = np.asarray(lists[0])
+        for postings in lists[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, postings, assume_unique=True)
+        return result
+
+    def some_of(self, grams, min_shared: int):
+        """Docs sharing at least min_shared grams with the query."""
+        lists = [self.postings(g) for g in grams]
+        if not lists:
+            return np.empty(0, dtype=np.uint32)
+        docs, shared = np.unique(np.concatenate(lists), return_counts=True)
+        return docs[shared >= min_shared]
+
+    def fuzzy_candidates(self, needle: str, max_edits: int = FUZZY_MAX_EDITS):
+        """
+        Docs that can hold a token within max_edits of needle. An edit of a character
+        w bytes long destroys at most w + q - 1 of the needle's q-grams, so a match
+        shares the rest; when that leaves none, every document is a candidate.
+        """
+        text = needle.encode()
+        width = max((len(c.encode()) for c in needle), default=1)
+        for q, grams in ((3, trigrams(text)), (2, bigrams(text))):
+            min_shared = len(grams) - max_edits * (width + q - 1)
+            if min_shared > 0:
+                return self.some_of(grams, min_shared)
+        return np.arange(self.count, dtype=np.uint32)
+
+    def match(self, tier: str, query: str, data_type: str = None, identifier=None):
+        """
+        Verified (doc_id, score) matches of one tier in this segment, plus the
+        number of candidates left unverified because of LOCAL_VERIFY_LIMIT.
+        Like the ES tiers, each tier includes the matches of the previous ones.
+        """
+        if tier == "exact":
+            candidates = self.exact(identifier[0], identifier[1])
+            return [(int(d), TIER_SCORES["exact"]) for d in candidates], 0
+
+        needle = query.lower()
+        if tier == "fuzzy":
+            candidates = self.fuzzy_candidates(needle)
+        else:
+            candidates = self.all_of(query_grams(needle.encode()))
+        if data_type and len(candidates):
+            candidates = candidates[self.types[candidates] == type_code(data_type)]
+
+        limit = settings.LOCAL_VERIFY_LIMIT
+        unverified = max(0, len(candidates) - limit)
+        # Token boundaries roughly as the standard analyzer sees them
+        phrase = re.compile(r"(?<!\w)" + re.escape(needle) + r"(?!\w)")
+        matches = []
+        for doc_id in candidates[:limit]:
+            value = self.value(int(doc_id))
+            if phrase.search(value):
+                matches.append((int(doc_id), TIER_SCORES["phrase"]))
+            elif tier in ("substring", "fuzzy") and needle in value:
+                matches.append((int(doc_id), TIER_SCORES["substring"]))
+            elif tier == "fuzzy" and any(
+                within_edits(needle, token, FUZZY_MAX_EDITS) for token in re.split(r"[^\w]+", value) if token
+            ):
+                matches.append((int(doc_id), TIER_SCORES["fuzzy"]))
+        return matches, unverified
+
+
+class LocalIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()  # writers
+        self._reload_lock = threading.Lock()
+        self._manifest_mtime = None
+        self.segments = []
+        self.reload()
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.isdir(path) and any(name.startswith("seg_") and not name.endswith(".tmp") for name in os.listdir(path))
+
+    @property
+    def _manifest_path(self):
+        return os.path.join(self.path, MANIFEST)
+
+    def _manifest_state(self):
+        try:
+            stat = os.stat(self._manifest_path)
+            # Every commit replaces the file, so the inode changes even within one mtime tick
+            return stat.st_ino, stat.st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _segment_names(self) -> list:
+        try:
+            with open(self._manifest_path) as f:
+                return json.load(f)["segments"]
+        except FileNotFoundError:
+            # Indices written before the manifest existed
+            return sorted(n for n in os.listdir(self.path) if n.startswith("seg_") and not n.endswith(".tmp"))
+
+    def reload(self):
+        os.makedirs(self.path, exist_ok=True)
+        with self._reload_lock:
+            # Segments are immutable, so ones already open are kept as they are
+            opened = {segment.path: segment for segment in self.segments}
+            for _ in range(3):
+                state = self._manifest_state()
+                paths = [os.path.join(self.path, name) for name in self._segment_names()]
+                try:
+                    self.segments = [opened.get(path) or Segment(path) for path in paths]
+                except FileNotFoundError:
+                    # Merged away by another process since the manifest was read
+                    continue
+                self._manifest_mtime = state
+                return
+        raise RuntimeError(f"Local index at {self.path} keeps changing, could not open its segments")
+
+    def maybe_reload(self):
+        """Pick up segments another process added or merged since the index was opened."""
+        if self._manifest_state() != self._manifest_mtime:
+            self.reload()
+
+    def _commit(self, segments: list):
+        """Make segments the live ones. Only called while holding the writer lock."""
+        tmp_path = f"{self._manifest_path}.tmp"
+        with open(tmp_path, "w") as out:
+            json.dump({"segments": [os.path.basename(segment) for segment in segments]}, out)
+        os.replace(tmp_path, self._manifest_path)
+        self.reload()
+
+    @contextmanager
+    def _writing(self):
+        """Serialize writers within and across processes, on an up to date segment list."""
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            with open(os.path.join(self.path, "index.lock"), "w") as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                self.reload()
+                yield
+
+    def count(self) -> int:
+        self.maybe_reload()
+        return sum(segment.count for segment in self.segments)
+
+    def _new_segment_path(self):
+        return os.path.join(self.path, f"seg_{time.time_ns():020d}_{uuid.uuid4().hex[:8]}")
+
+    def _rewrite(self, old: list):
+        """Replace segments with as few full-size segments holding the same documents."""
+        new = []
+        batch = []
+        for segment in old:
+            for doc_id in range(segment.count):
+                batch.append(segment.document(doc_id))
+                if len(batch) >= settings.LOCAL_SEGMENT_MAX_DOCS:
+                    new.append(self._new_segment_path())
+                    write_segment(new[-1], batch)
+                    batch = []
+        if batch:
+            new.append(self._new_segment_path())
+            write_segment(new[-1], batch)
+        old_paths = {segment.path for segment in old}
+        self._commit([segment.path for segment in self.segments if segment.path not in old_paths] + new)
+        # Readers that still have them open keep their mapped files until they reload
+        for path in old_paths:
+            shutil.rmtree(path)
+
+    def _merge_small_segments(self):
+        """
+        Merge LOCAL_MERGE_FACTOR segments of about the same size into one whenever there are
+        that many, so repeated small adds leave O(log n) segments and each document is
+        only rewritten once per size tier.
+        """
+        factor = max(2, settings.LOCAL_MERGE_FACTOR)
+        while True:
+            tiers = {}
+            for segment in self.segments:
+                if segment.count < settings.LOCAL_SEGMENT_MAX_DOCS:
+                    tiers.setdefault(int(math.log(max(segment.count, 1), factor)), []).append(segment)
+            full = next((segments for segments in tiers.values() if len(segments) >= factor), None)
+            if full is None:
+                return
+            self._rewrite(full[:factor])
+
+    def add_documents(self, documents: list) -> int:
+        """Write documents as new segments of at most LOCAL_SEGMENT_MAX_DOCS each."""
+        step = settings.LOCAL_SEGMENT_MAX_DOCS
+        # Written before taking the lock; nobody sees them until they are committed
+        new = []
+        for i in range(0, len(documents), step):
+            new.append(self._new_segment_path())
+            write_segment(new[-1], documents[i:i + step])
+        with self._writing():
+            # An index without a manifest yet lists them already
+            self._commit([segment.path for segment in self.segments if segment.path not in new] + new)
+            self._merge_small_segments()
+        return len(documents)
+
+    def compact(self):
+        """Rewrite all segments into as few full-size segments as possible."""
+        with self._writing():
+            if len(self.segments) > 1:
+                self._rewrite(list(self.segments))
+
+    def _format(self, segment: Segment, doc_id: int, score: float) -> dict:
+        source = segment.document(doc_id)
+        return {
+            "type": source["type"],
+            "value": source["value"],
+            "source": source.get("source", ""),
+            "additional_info": source.get("additional_info", ""),
+            "score": score
+        }
+
+    def _matches(self, tier: str, query: str, data_type: str = None, identifier=None):
+        """All verified matches as (score, segment, doc_id), plus unverified candidate counts per type."""
+        self.maybe_reload()
+        matches = []
+        unverified = 0
+        for segment in list(self.segments):
+            found, skipped = segment.match(tier, query, data_type, identifier)
+            matches.extend((score, segment, doc_id) for doc_id, score in found)
+            unverified += skipped
+        return matches, unverified
+
+    def search_tier(self, tier: str, query: str, data_type: str = None, identifier=None, per_type: int = 10):
+        """One search tier, in the grouped shape search_data returns."""
+        matches, unverified = self._matches(tier, query, data_type, identifier)
+        by_type = {}
+        for score, segment, doc_id in matches:
+            by_type.setdefault(int(segment.types[doc_id]), []).append((score, segment, doc_id))
+
+        verified = len(matches)
+        grouped_results = {}
+        for code, items in by_type.items():
+            items.sort(key=lambda item: -item[0])
+            count = len(items)
+            if unverified and verified:
+                # Too many candidates to verify: extrapolate from the verified share
+                count += round(unverified * len(items) / verified)
+            top = [self._format(segment, doc_id, score) for score, segment, doc_id in items[:per_type]]
+            dtype = DATA_TYPES[code] if code != UNKNOWN_TYPE else top[0]["type"]
+            grouped_results[dtype] = {"count": count, "results": top}
+        return grouped_results
+
+    def search_hits(self, tier: str, query: str, data_type: str, identifier=None, offset: int = 0, size: int = 10):
+        """One page of a type's matches in score order, and the total."""
+        matches, unverified = self._matches(tier, query, data_type, identifier)
+        matches.sort(key=lambda item: -item[0])
+        page = [self._format(segment, doc_id, score) for score, segment, doc_id in matches[offset:offset + size]]
+        return page, len(matches) + unverified
+
+
+_local_index = None
+
+
+def get_local_index() -> LocalIndex:
+    global _local_index
+    if _local_index is None:
+        _local_index = LocalIndex(settings.LOCAL_INDEX_DIR)
+    return _local_index
+
+
+class LocalBackend:
+    """The embedded local index, as a search backend (see app.elasticsearch_client.SearchBackend)."""
+
+    async def create_index(self):
+        get_local_index()
+
+    @asynccontextmanager
+    async def bulk_load_mode(self, force_merge: bool = False, index_name: str = None):
+        # Segments are only searchable once written, there is nothing to turn off
+        yield
+
+    async def index_documents(self, documents, dead_letter_path: str = None, progress: dict = None,
+                              concurrency: int = None, op_type: str = None, index_name: str = None):
+        success = 0
+        async for batch in aiter_batches(documents, settings.BULK_QUEUE_SIZE):
+            await ingest_limiter.acquire(len(batch))
+            success += await asyncio.to_thread(get_local_index().add_documents, batch)
+            if progress is not None:
+                # The local index is append-only, every document counts as new
+                progress["processed"] = progress.get("processed", 0) + len(batch)
+                progress["created"] = progress.get("created", 0) + len(batch)
+        return success, 0
+
+    async def delete_documents(self, ids: list, index_name: str = None) -> int:
+        logger.warning(f"The local index is append-only, {len(ids)} documents were not deleted")
+        return 0
+
+    async def search_tier(self, tier: str, query: str, data_type: str, identifier, per_type: int = 10):
+        started = time.monotonic()
+        grouped = await asyncio.to_thread(get_local_index().search_tier, tier, query, data_type, identifier, per_type)
+        return grouped, {"took": int((time.monotonic() - started) * 1000)}
+
+    async def msearch_tiers(self, searches: list, per_type: int = 10) -> list:
+        results = []
+        for tier, query, data_type, identifier in searches:
+            try:
+                results.append(await self.search_tier(tier, query, data_type, identifier, per_type))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    async def search_page(self, query: str, data_type: str, size: int, pit_id: str, search_after: list,
+                          exact: bool, identifier) -> dict:
+        """Segments are immutable, so an offset is a stable cursor."""
+        offset = search_after[0] if search_after else 0
+        index = get_local_index()
+        tier = "exact" if exact else "fuzzy"
+        page, total = await asyncio.to_thread(index.search_hits, tier, query, data_type, identifier, offset, size)
+        if exact and not offset and not page:
+            exact = False
+            page, total = await asyncio.to_thread(index.search_hits, "fuzzy", query, data_type, None, 0, size)
+        next_after = [offset + size] if len(page) == size else None
+        return {
+            "results": page,
+            "total": total if not offset else None,
+            "pit_id": "local" if next_after is not None else None,
+            "search_after": next_after,
+            "exact": exact
+        }
+
+    async def scan_documents(self):
+        index = get_local_index()
+        index.maybe_reload()
+        for segment in list(index.segments):
+            for doc_id in range(segment.count):
+                yield segment.document(doc_id)
+
+    async def stats(self) -> dict:
+        return {"total_documents": get_local_index().count(), "backend": "local"}
+
+
+local_backend = LocalBackend()
@@ -18,7 +18,9 @@ from app.auth import (
 )
 from app.database import init_db, get_db
 from app.models import User
-from app.elasticsearch_client import create_index_if_not_exists
+from app.elasticsearch_client import create_index_if_not_exists, close_es, activate_local_fallback
+from app.bloom import get_bloom_index
+from app.jobs import resume_jobs
 import logging
 import secrets
 from datetime import datetime, timedelta
@@ -72,7 +74,26 @@ async def startup():
         await create_index_if_not_exists()
         logger.info("Elasticsearch index ready")
     except Exception as e:
-        logger.warning(f"Elasticsearch not available: {e} - running without search functionality")
+        if activate_local_fallback():
+            logger.warning(f"Elasticsearch not available: {e} - searching the local index instead")
+        else:
+            logger.warning(f"Elasticsearch not available: {e} - running without search functionality")
+    
+    # Pick up upload/enrichment jobs interrupted by a restart
+    try:
+        resumed = resume_jobs()
+        if resumed:
+            logger.info(f"Resumed {resumed} interrupted jobs")
+    except Exception as e:
+        logger.error(f"Could not resume jobs: {e}")
+
+
+# Shutdown event
+@app.on_event("shutdown")
+async def shutdown():
+    logger.info("Shutting down OSINT Investigator API...")
+    get_bloom_index().save()
+    await close_es()
 
 
 # Health check
@@ -0,0 +1,213 @@
+"""
+Delta imports against a manifest of what a data feed last delivered.
+
+A manifest is named after a feed (a vendor's monthly dump, say) and stored in
+the database next to the job records: the file's sha256, and per chunk of rows
+a hash of the raw rows plus each row's document id and a fingerprint of its
+document fields. A re-import then
+- stops right away if the file is byte-for-byte the last one,
+- skips a chunk whose raw rows hash the same as the chunk at the same offset
+  last time, without even normalizing it,
+- otherwise indexes only rows whose id is new or whose fingerprint changed,
+- and can delete the documents whose ids are no longer in the feed.
+
+Chunks are written under the importing run's id as they are processed, so an
+upload job resumed after a restart keeps the chunks it already did. The new
+run only replaces the previous one in commit(), after every row was handled.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from app.database import SessionLocal
+from app.ingest import DOCUMENT_FIELDS, document_id, document_keys, frame_documents, iter_chunks, prepare_frame
+from app.models import ImportManifest, ManifestChunk
+
+logger = logging.getLogger(__name__)
+
+KEY_DTYPE = "S16"
+FINGERPRINT_DTYPE = "<u8"
+RETRY = 0  # fingerprint of rows that failed to index, so the next run sends them again
+
+
+def chunk_hash(df: pd.DataFrame) -> str:
+    """Hash of a raw chunk, columns included."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update("\x1f".join(map(str, df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def row_fingerprints(frame: pd.DataFrame) -> np.ndarray:
+    """uint64 hash of every row's document fields."""
+    fingerprints = pd.util.hash_pandas_object(frame[DOCUMENT_FIELDS], index=False).values.astype(FINGERPRINT_DTYPE)
+    # Keep RETRY free for failed rows
+    fingerprints[fingerprints == RETRY] = 1
+    return fingerprints
+
+
+class ManifestRun:
+    """One import of a file against the manifest called name."""
+
+    def __init__(self, name: str, run_id: str):
+        self.run_id = run_id
+        db = SessionLocal()
+        try:
+            manifest = db.query(ImportManifest).filter(ImportManifest.name == name).first()
+            if manifest is None:
+                manifest = ImportManifest(name=name)
+                db.add(manifest)
+                db.commit()
+            self.manifest_id = manifest.id
+            self.checksum = manifest.checksum
+            self.rows = manifest.rows or 0
+            # Leftovers of runs that never committed
+            db.query(ManifestChunk).filter(
+                ManifestChunk.manifest_id == manifest.id,
+                ManifestChunk.run_id.notin_([manifest.run_id or "", run_id]),
+            ).delete(synchronize_session=False)
+            db.commit()
+            previous = db.query(ManifestChunk).filter(
+                ManifestChunk.manifest_id == manifest.id, ManifestChunk.run_id == manifest.run_id
+            ).order_by(ManifestChunk.start).all()
+        finally:
+            db.close()
+
+        self.previous_chunks = {chunk.start: (chunk.rows, chunk.content_hash, chunk.keys, chunk.fingerprints)
+                                for chunk in previous}
+        keys = np.frombuffer(b"".join(chunk.keys for chunk in previous), dtype=KEY_DTYPE)
+        fingerprints = np.frombuffer(b"".join(chunk.fingerprints for chunk in previous), dtype=FINGERPRINT_DTYPE)
+        # Sorted, keeping the last row of duplicate ids, for searchsorted lookups
+        keys, last = np.unique(keys[::-1], return_index=True)
+        self.keys = keys
+        self.fingerprints = fingerprints[::-1][last]
+        if len(keys):
+            logger.info(f"Manifest {name}: {len(keys)} rows from the previous import")
+
+    def file_unchanged(self, checksum: str) -> bool:
+        return self.checksum is not None and self.checksum == checksum
+
+    def _save_chunk(self, start: int, rows: int, content_hash, keys: bytes, fingerprints: bytes):
+        db = SessionLocal()
+        try:
+            # A resumed job redoes the chunk after its last checkpoint
+            db.query(ManifestChunk).filter(
+                ManifestChunk.manifest_id == self.manifest_id,
+                ManifestChunk.run_id == self.run_id,
+                ManifestChunk.start == start,
+            ).delete(synchronize_session=False)
+            db.add(ManifestChunk(
+                manifest_id=self.manifest_id, run_id=self.run_id, start=start, rows=rows,
+                content_hash=content_hash, keys=keys, fingerprints=fingerprints,
+            ))
+            db.commit()
+        finally:
+            db.close()
+
+    def filter_chunk(self, start: int, df: pd.DataFrame):
+        """
+        Record the chunk of rows at row offset start and return (frame, unchanged):
+        the prepare_frame() rows that are new or changed, or None if there are none,
+        and how many rows need no indexing.
+        """
+        content_hash = chunk_hash(df)
+        previous = self.previous_chunks.get(start)
+        if previous and previous[0] == len(df) and previous[1] == content_hash:
+            self._save_chunk(start, len(df), content_hash, previous[2], previous[3])
+            return None, len(df)
+
+        frame = prepare_frame(df)
+        keys = np.array(document_keys(frame), dtype=KEY_DTYPE)
+        fingerprints = row_fingerprints(frame)
+        changed = np.ones(len(frame), dtype=bool)
+        if len(self.keys):
+            positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+            known = self.keys[positions] == keys
+            changed = ~known | (self.fingerprints[positions] != fingerprints)
+        self._save_chunk(start, len(df), content_hash, keys.tobytes(), fingerprints.tobytes())
+        unchanged = int(len(frame) - changed.sum())
+        return (frame[changed] if unchanged < len(frame) else None), unchanged
+
+    def _chunks(self, db):
+        return db.query(ManifestChunk).filter(
+            ManifestChunk.manifest_id == self.manifest_id, ManifestChunk.run_id == self.run_id
+        ).all()
+
+    def missing_ids(self) -> list:
+        """Document ids of the previous import that are not in this one."""
+        db = SessionLocal()
+        try:
+            current = np.frombuffer(b"".join(chunk.keys for chunk in self._chunks(db)), dtype=KEY_DTYPE)
+        finally:
+            db.close()
+        # From the raw bytes: numpy drops trailing zero bytes from S16 items
+        missing = self.keys[~np.isin(self.keys, current)].tobytes()
+        return [missing[i:i + 16].hex() for i in range(0, len(missing), 16)]
+
+    def commit(self, checksum: str, failed_ids: set = None):
+        """
+        Make this run the manifest's current one. Rows in failed_ids (document ids
+        that were rejected) are marked so the next import sends them again.
+        """
+        db = SessionLocal()
+        try:
+            chunks = self._chunks(db)
+            if failed_ids:
+                failed = np.array([bytes.fromhex(doc_id) for doc_id in failed_ids], dtype=KEY_DTYPE)
+                for chunk in chunks:
+                    keys = np.frombuffer(chunk.keys, dtype=KEY_DTYPE)
+                    retry = np.isin(keys, failed)
+                    if retry.any():
+                        fingerprints = np.frombuffer(chunk.fingerprints, dtype=FINGERPRINT_DTYPE).copy()
+                        fingerprints[retry] = RETRY
+                        chunk.fingerprints = fingerprints.tobytes()
+                        chunk.content_hash = None
+            manifest = db.get(ImportManifest, self.manifest_id)
+            previous_run = manifest.run_id
+            manifest.run_id = self.run_id
+            # A file with rejected rows must not be skipped as a whole next time
+            manifest.checksum = None if failed_ids else checksum
+            manifest.rows = sum(chunk.rows for chunk in chunks)
+            manifest.updated_at = datetime.utcnow()
+            if previous_run and previous_run != self.run_id:
+                db.query(ManifestChunk).filter(
+                    ManifestChunk.manifest_id == self.manifest_id, ManifestChunk.run_id == previous_run
+                ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+
+def dead_letter_ids(path: str) -> set:
+    """Document ids of the documents in a dead-letter file."""
+    ids = set()
+    if path and os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                ids.add(document_id(json.loads(line)["document"]))
+    return ids
+
+
+async def aiter_delta_documents(path: str, run: ManifestRun, chunk_rows: int, progress: dict,
+                                on_chunk=None):
+    """Yield the documents of a file's new and changed rows; skipped rows are counted as unchanged."""
+    chunks = iter_chunks(path, chunk_rows=chunk_rows)
+    start = 0
+    while True:
+        df = await asyncio.to_thread(next, chunks, None)
+        if df is None:
+            return
+        frame, unchanged = await asyncio.to_thread(run.filter_chunk, start, df)
+        start += len(df)
+        progress["unchanged"] = progress.get("unchanged", 0) + unchanged
+        if on_chunk is not None:
+            on_chunk(len(df))
+        if frame is not None:
+            for doc in frame_documents(frame):
+                yield doc
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, JSON, LargeBinary
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.database import Base
@@ -24,7 +24,7 @@ class User(Base):
     stripe_subscription_id = Column(String, nullable=True)
     api_key = Column(String, unique=True, nullable=True)
     
-    team = relationship("Team", back_populates="members")
+    team = relationship("Team", back_populates="members", foreign_keys=[team_id])
     search_logs = relationship("SearchLog", back_populates="user")
 
 
@@ -40,7 +40,7 @@ class Team(Base):
     admin_user_id = Column(Integer, ForeignKey("users.id"))
     created_at = Column(DateTime, default=datetime.utcnow)
     
-    members = relationship("User", back_populates="team")
+    members = relationship("User", back_populates="team", foreign_keys="User.team_id")
 
 
 class SearchLog(Base):
@@ -54,3 +54,58 @@ class SearchLog(Base):
     timestamp = Column(DateTime, default=datetime.utcnow)
     
     user = relationship("User", back_populates="search_logs")
+
+
+class IngestJob(Base):
+    __tablename__ = "ingest_jobs"
+    
+    id = Column(String, primary_key=True)  # job_<uuid4 hex>
+    kind = Column(String, nullable=False)  # upload or enrich
+    owner_id = Column(Integer, ForeignKey("users.id"))
+    status = Column(String, default="queued", index=True)  # queued, running, paused, completed, failed, cancelled
+    priority = Column(Integer, default=0)  # higher runs first; FIFO within a priority
+    control = Column(String, nullable=True)  # pause or cancel, requested while running
+    filename = Column(String, nullable=True)
+    file_path = Column(String, nullable=True)  # spooled upload, removed when the job ends
+    checksum = Column(String, nullable=True)  # sha256 of the uploaded file
+    options = Column(JSON, nullable=True)  # e.g. op_type, bulk_mode, force_merge, manifest
+    offset = Column(Integer, default=0)  # rows fully handled as of the last checkpoint
+    total = Column(Integer, default=0)  # rows read so far
+    processed = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    created = Column(Integer, default=0)
+    updated = Column(Integer, default=0)
+    unchanged = Column(Integer, default=0)
+    deleted = Column(Integer, default=0)
+    matched = Column(Integer, default=0)
+    result_offset = Column(Integer, default=0)  # bytes of the result file as of the last checkpoint
+    dead_letter = Column(String, nullable=True)
+    error = Column(String, nullable=True)
+    worker_id = Column(String, nullable=True)  # host:pid running the job
+    heartbeat_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ImportManifest(Base):
+    __tablename__ = "import_manifests"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, nullable=False)  # one per data feed, e.g. a vendor's monthly dump
+    run_id = Column(String, nullable=True)  # the import whose chunks are current
+    checksum = Column(String, nullable=True)  # sha256 of that import's file, unset if some rows failed
+    rows = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ManifestChunk(Base):
+    __tablename__ = "manifest_chunks"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    manifest_id = Column(Integer, ForeignKey("import_manifests.id"), index=True)
+    run_id = Column(String, index=True)  # job id or CLI run that wrote it
+    start = Column(Integer)  # row offset of the chunk in the file
+    rows = Column(Integer)
+    content_hash = Column(String, nullable=True)  # of the raw rows; unset if some rows failed to index
+    keys = Column(LargeBinary)  # 16-byte document ids, one per row
+    fingerprints = Column(LargeBinary)  # uint64 hash of each row's document fields
@@ -0,0 +1,117 @@
+"""
+Canonical forms for identifier values.
+
+The same normalizers run at ingest time (stored in the value_norm keyword
+field) and at query time, so a fully formed identifier can be answered with
+a single term lookup.
+"""
+import re
+from typing import Optional, Tuple
+
+import pandas as pd
+
+from app.config import settings
+
+DATA_TYPES = ["email", "phone", "username", "vehicle", "upi"]
+
+EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[a-z]{2,}$")
+UPI_RE = re.compile(r"^[a-z0-9._-]{2,256}@[a-z][a-z0-9]{1,63}$")
+PHONE_RE = re.compile(r"^\+[1-9]\d{7,14}$")
+NATIONAL_PHONE_DIGITS = 10  # local numbers in the default country
+# Indian registration plates, e.g. MH12AB1234, DL3CAF0001, 22BH1234AA
+VEHICLE_RE = re.compile(r"^([A-Z]{2}\d{1,2}[A-Z]{0,3}\d{4}|\d{2}BH\d{4}[A-Z]{1,2})$")
+
+
+def normalize_email(value: str) -> str:
+    return value.strip().lower()
+
+
+def normalize_phone(value: str) -> str:
+    """Normalize to E.164, assuming the default country for local numbers."""
+    value = value.strip()
+    digits = re.sub(r"\D", "", value)
+    if value.startswith("+"):
+        return f"+{digits}"
+    if value.startswith("00"):
+        return f"+{digits[2:]}"
+    digits = digits.lstrip("0")
+    if len(digits) == NATIONAL_PHONE_DIGITS:
+        return f"+{settings.DEFAULT_PHONE_COUNTRY_CODE}{digits}"
+    return f"+{digits}" if digits else ""
+
+
+def is_full_phone(value: str) -> bool:
+    """
+    Whether value names a whole phone number: one with an international prefix, or a
+    local number of the national length. Other digit runs may be part of a longer number.
+    """
+    value = value.strip()
+    if not re.fullmatch(r"[\d\s()+.-]+", value):
+        return False
+    if value.lstrip("(").startswith(("+", "00")):
+        return bool(PHONE_RE.match(normalize_phone(value)))
+    return len(re.sub(r"\D", "", value).lstrip("0")) == NATIONAL_PHONE_DIGITS
+
+
+def normalize_vehicle(value: str) -> str:
+    return re.sub(r"[^A-Za-z0-9]", "", value).upper()
+
+
+def normalize_upi(value: str) -> str:
+    return value.strip().lower()
+
+
+def normalize_username(value: str) -> str:
+    return value.strip().lstrip("@").lower()
+
+
+NORMALIZERS = {
+    "email": normalize_email,
+    "phone": normalize_phone,
+    "vehicle": normalize_vehicle,
+    "upi": normalize_upi,
+    "username": normalize_username,
+}
+
+
+def normalize_value(data_type: str, value: str) -> str:
+    """Return the canonical form of value for the given data type."""
+    normalizer = NORMALIZERS.get(data_type)
+    if normalizer is None:
+        return value.strip().lower()
+    return normalizer(value)
+
+
+def normalize_series(data_type: str, values: pd.Series) -> pd.Series:
+    """Column-wise normalize_value for a Series of strings of a single type."""
+    if data_type in ("email", "upi"):
+        return values.str.strip().str.lower()
+    if data_type == "username":
+        return values.str.strip().str.lstrip("@").str.lower()
+    if data_type == "vehicle":
+        return values.str.replace(r"[^A-Za-z0-9]", "", regex=True).str.upper()
+    if data_type == "phone":
+        # Too branchy to express with string methods
+        return values.map(normalize_phone)
+    return values.str.strip().str.lower()
+
+
+def classify_identifier(query: str, data_type: str = None) -> Optional[Tuple[str, str]]:
+    """
+    Detect a fully formed identifier.
+    Returns (type, normalized value) or None when the query is partial.
+    """
+    candidates = [data_type] if data_type else ["email", "upi", "phone", "vehicle"]
+    for dtype in candidates:
+        if dtype not in NORMALIZERS:
+            continue
+        normalized = normalize_value(dtype, query)
+        if dtype == "email" and EMAIL_RE.match(normalized):
+            return dtype, normalized
+        if dtype == "upi" and UPI_RE.match(normalized):
+            return dtype, normalized
+        if dtype == "phone" and is_full_phone(query):
+            return dtype, normalized
+        if dtype == "vehicle" and VEHICLE_RE.match(normalized):
+            return dtype, normalized
+    return None
@@ -1,13 +1,24 @@
 from fastapi import APIRouter, Depends, HTTPException
-from typing import Optional
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
 from pydantic import BaseModel
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
-from datetime import datetime
+from datetime import datetime, timedelta
+from jose import ExpiredSignatureError, JWTError, jwt
+import hashlib
+import hmac
+import json
 
-from app.elasticsearch_client import search_data, get_index_stats
+from app.config import settings
+from app.elasticsearch_client import (
+    search_data, msearch_data, search_page, get_index_stats, keep_alive_seconds, PointInTimeExpired, DATA_TYPES,
+)
+from app.search_cache import search_cache, search_flight
+from app.bloom import get_bloom_index
 from app.auth import get_current_user
 from app.models import User, SearchLog
-from app.database import get_db
+from app.database import get_db, SessionLocal
 from slowapi.util import get_remote_address
 from slowapi import Limiter
 from fastapi import Request
@@ -22,18 +33,155 @@ class SearchQuery(BaseModel):
     type: Optional[str] = None  # email, phone, username, vehicle, upi, or None for all
 
 
+class BatchSearchRequest(BaseModel):
+    queries: List[SearchQuery]
+    fuzzy: bool = False  # also run fuzzy matching for fully formed identifiers
+
+
+def format_search_response(q: str, type: Optional[str], results: dict):
+    """Build the /api/search response, with every data type present even if empty."""
+    formatted_results = {}
+    for dtype in DATA_TYPES:
+        formatted_results[dtype] = results.get(dtype, {"count": 0, "results": []})
+    
+    return {
+        "query": q,
+        "type": type or "all",
+        "total_results": sum(group["count"] for group in results.values()),
+        "results_by_type": formatted_results
+    }
+
+
+async def run_search(q: str, type: Optional[str] = None, tiers: list = None, fuzzy: bool = False):
+    """search_data behind single-flight: concurrent identical searches share one ES call."""
+    key = search_cache.key(q, type, fuzzy) + (search_cache.generation,)
+
+    async def call():
+        ran = []
+        return await search_data(q, type, tiers=ran, fuzzy=fuzzy), ran
+
+    results, ran = await search_flight.do(key, call)
+    if tiers is not None:
+        tiers.extend(ran)
+    return results
+
+
+async def iter_grouped_results(q: str, type: Optional[str] = None, tiers: list = None, fuzzy: bool = False):
+    """
+    Yield the (type, group) pairs of the same single query /search runs.
+    Results are cached under the same (q, type) key, so both paths always
+    serve the same results.
+    """
+    results = search_cache.get(q, type, fuzzy)
+    if results is None:
+        generation = search_cache.generation
+        results = await run_search(q, type, tiers, fuzzy)
+        search_cache.put(q, type, results, generation, fuzzy)
+    for group_type, group in results.items():
+        yield group_type, group
+
+
+def charge_searches(user_id: int, count: int = 1) -> bool:
+    """Take count searches from the user with a conditional update; False if too few are left."""
+    db = SessionLocal()
+    try:
+        charged = db.query(User).filter(User.id == user_id, User.searches_remaining >= count).update(
+            {User.searches_remaining: User.searches_remaining - count}, synchronize_session=False
+        )
+        db.commit()
+        return charged > 0
+    finally:
+        db.close()
+
+
+def refund_searches(user_id: int, count: int = 1):
+    db = SessionLocal()
+    try:
+        db.query(User).filter(User.id == user_id).update(
+            {User.searches_remaining: User.searches_remaining + count}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def stream_search(q: str, type: Optional[str], user_id: int, fuzzy: bool = False):
+    """
+    NDJSON records: one per type, one per hit, then a summary with totals.
+    The search is charged when its first results arrive and refunded if it then fails,
+    so like the non-stream path only searches that succeed cost a credit.
+    """
+    limit_reached = json.dumps({"event": "error", "detail": "Search limit reached. Please upgrade your plan."}) + "\n"
+
+    async def generate():
+        counts = {dtype: 0 for dtype in DATA_TYPES}
+        tiers = []
+        charged = False
+        try:
+            async for dtype, group in iter_grouped_results(q, type, tiers, fuzzy):
+                if not charged:
+                    if not charge_searches(user_id):
+                        yield limit_reached
+                        return
+                    charged = True
+                counts[dtype] = group["count"]
+                yield json.dumps({"event": "type", "type": dtype, "count": group["count"]}) + "\n"
+                for hit in group["results"]:
+                    yield json.dumps({"event": "hit", **hit}) + "\n"
+        except Exception as e:
+            if charged:
+                refund_searches(user_id)
+            yield json.dumps({"event": "error", "detail": f"Search error: {str(e)}"}) + "\n"
+            return
+        
+        # A search without any result groups still costs a credit, as on the non-stream path
+        if not charged and not charge_searches(user_id):
+            yield limit_reached
+            return
+        
+        total_results = sum(counts.values())
+        db = SessionLocal()
+        try:
+            db.add(SearchLog(
+                user_id=user_id,
+                query=q,
+                data_type=type,
+                results_count=total_results,
+                timestamp=datetime.utcnow()
+            ))
+            db.commit()
+        finally:
+            db.close()
+        
+        yield json.dumps({
+            "event": "summary",
+            "query": q,
+            "type": type or "all",
+            "total_results": total_results,
+            "counts": counts,
+            "tiers": tiers
+        }) + "\n"
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
 @router.get("/search")
 @limiter.limit("30/minute")
 async def search(
     request: Request,
     q: str,
     type: Optional[str] = None,
+    stream: bool = False,
+    fuzzy: bool = False,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
     Search for data across all or specific types.
     Results are grouped by data type for step-by-step display.
+    With ?stream=1 or Accept: application/x-ndjson, results are streamed
+    as NDJSON records. Fully formed identifiers
+    skip fuzzy matching unless ?fuzzy=1 is given.
     """
     if not q or len(q.strip()) < 2:
         raise HTTPException(status_code=400, detail="Query must be at least 2 characters")
@@ -50,16 +198,24 @@ async def search(
         )
     
     # Validate type if provided
-    valid_types = ["email", "phone", "username", "vehicle", "upi"]
-    if type and type not in valid_types:
-        raise HTTPException(status_code=400, detail=f"Invalid type. Must be one of: {', '.join(valid_types)}")
+    if type and type not in DATA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Invalid type. Must be one of: {', '.join(DATA_TYPES)}")
+    
+    if stream or "application/x-ndjson" in request.headers.get("accept", ""):
+        # Charged once results arrive; the SearchLog is written once the totals are known
+        return stream_search(q, type, current_user.id, fuzzy)
     
     try:
-        # Search Elasticsearch
-        results = await search_data(q, type)
+        # Serve hot queries from the cache; quota and logging below still apply
+        results = search_cache.get(q, type, fuzzy)
+        tiers = []
+        if results is None:
+            generation = search_cache.generation
+            results = await run_search(q, type, tiers, fuzzy)
+            search_cache.put(q, type, results, generation, fuzzy)
         
         # Calculate total results
-        total_results = sum(len(v) for v in results.values())
+        total_results = sum(group["count"] for group in results.values())
         
         # Log search
         search_log = SearchLog(
@@ -75,31 +231,232 @@ async def search(
         current_user.searches_remaining -= 1
         db.commit()
         
-        # Ensure all data types are represented even if empty
-        all_types = ["email", "phone", "username", "vehicle", "upi"]
-        formatted_results = {}
+        response = format_search_response(q, type, results)
+        # Which query tiers ran (empty when served from the cache)
+        response["tiers"] = tiers
+        return response
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Search error: {str(e)}")
+
+
+@router.post("/search/batch")
+@limiter.limit("10/minute")
+async def search_batch(
+    request: Request,
+    data: BatchSearchRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Look up many (query, type) pairs in one _msearch round trip.
+    Each pair that succeeds costs one search credit; results come back in input order.
+    """
+    items = data.queries
+    if not items:
+        raise HTTPException(status_code=400, detail="At least one query is required")
+    if len(items) > settings.SEARCH_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {settings.SEARCH_BATCH_MAX} queries per batch")
+    for item in items:
+        if not item.query or len(item.query.strip()) < 2:
+            raise HTTPException(status_code=400, detail="Query must be at least 2 characters")
+        if item.type and item.type not in DATA_TYPES:
+            raise HTTPException(status_code=400, detail=f"Invalid type. Must be one of: {', '.join(DATA_TYPES)}")
+    
+    if not current_user.is_verified:
+        raise HTTPException(status_code=403, detail="Please verify your email before searching")
+    if current_user.searches_remaining < len(items):
+        raise HTTPException(
+            status_code=403,
+            detail="Search limit reached. Please upgrade your plan."
+        )
+    
+    try:
+        # Cached pairs are answered locally, the rest share one _msearch
+        generation = search_cache.generation
+        results = [search_cache.get(item.query, item.type, data.fuzzy) for item in items]
+        misses = [i for i, cached in enumerate(results) if cached is None]
+        if misses:
+            fetched = await msearch_data([(items[i].query, items[i].type) for i in misses], fuzzy=data.fuzzy)
+            for i, grouped in zip(misses, fetched):
+                results[i] = grouped
+                if not isinstance(grouped, Exception):
+                    search_cache.put(items[i].query, items[i].type, grouped, generation, data.fuzzy)
+        
+        # Charge the searches that succeeded at once, so concurrent requests can't overdraw
+        succeeded = sum(not isinstance(grouped, Exception) for grouped in results)
+        if succeeded and not charge_searches(current_user.id, succeeded):
+            raise HTTPException(
+                status_code=403,
+                detail="Search limit reached. Please upgrade your plan."
+            )
         
-        for dtype in all_types:
-            if dtype in results:
-                formatted_results[dtype] = {
-                    "count": len(results[dtype]),
-                    "results": results[dtype][:10]  # Limit to top 10 per type
-                }
-            else:
-                formatted_results[dtype] = {
-                    "count": 0,
-                    "results": []
-                }
+        now = datetime.utcnow()
+        responses = []
+        log_rows = []
+        for item, grouped in zip(items, results):
+            if isinstance(grouped, Exception):
+                responses.append({
+                    "query": item.query,
+                    "type": item.type or "all",
+                    "error": f"Search error: {str(grouped)}"
+                })
+                continue
+            response = format_search_response(item.query, item.type, grouped)
+            responses.append(response)
+            log_rows.append({
+                "user_id": current_user.id,
+                "query": item.query,
+                "data_type": item.type,
+                "results_count": response["total_results"],
+                "timestamp": now
+            })
+        if log_rows:
+            db.execute(insert(SearchLog), log_rows)
+            db.commit()
+        
+        return {"results": responses}
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Search error: {str(e)}")
+
+
+CURSOR_EXPIRED = "Cursor expired, start the search again"
+CURSOR_AUDIENCE = "search-cursor"
+CURSOR_TYPE = "cursor"
+CURSOR_ALGORITHM = "HS256"
+
+
+def cursor_key() -> str:
+    """Key cursors are signed with, derived from SECRET_KEY so cursors and access tokens never pass as each other."""
+    return hmac.new(settings.SECRET_KEY.encode(), CURSOR_AUDIENCE.encode(), hashlib.sha256).hexdigest()
+
+
+def create_cursor(data: dict) -> str:
+    """
+    Sign page state into an opaque cursor for /search/{type}/page.
+    It expires with the point in time it reads from, SEARCH_PIT_KEEP_ALIVE after this page.
+    """
+    to_encode = data.copy()
+    to_encode["exp"] = datetime.utcnow() + timedelta(seconds=keep_alive_seconds(settings.SEARCH_PIT_KEEP_ALIVE))
+    to_encode["aud"] = CURSOR_AUDIENCE
+    to_encode["typ"] = CURSOR_TYPE
+    return jwt.encode(to_encode, cursor_key(), algorithm=CURSOR_ALGORITHM)
+
+
+def decode_cursor(cursor: str) -> Optional[dict]:
+    """The page state of a cursor, or None if it is invalid; raises ExpiredSignatureError once it expired."""
+    try:
+        state = jwt.decode(cursor, cursor_key(), algorithms=[CURSOR_ALGORITHM], audience=CURSOR_AUDIENCE)
+    except ExpiredSignatureError:
+        raise
+    except JWTError:
+        return None
+    return state if state.get("typ") == CURSOR_TYPE else None
+
+
+@router.get("/search/{type}/page")
+@limiter.limit("60/minute")
+async def search_type_page(
+    request: Request,
+    type: str,
+    q: Optional[str] = None,
+    cursor: Optional[str] = None,
+    size: int = 10,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Page through every hit of a single type.
+    Start with ?q=..., then pass back next_cursor until it is null.
+    """
+    if type not in DATA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Invalid type. Must be one of: {', '.join(DATA_TYPES)}")
+    if size < 1 or size > 100:
+        raise HTTPException(status_code=400, detail="Page size must be between 1 and 100")
+    
+    if cursor:
+        try:
+            state = decode_cursor(cursor)
+        except ExpiredSignatureError:
+            raise HTTPException(status_code=410, detail=CURSOR_EXPIRED)
+        if state is None or state.get("uid") != current_user.id or state.get("type") != type:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        q = state["q"]
+        page = state["page"] + 1
+    else:
+        if not q or len(q.strip()) < 2:
+            raise HTTPException(status_code=400, detail="Query must be at least 2 characters")
+        state = {}
+        page = 1
+    
+    if not current_user.is_verified:
+        raise HTTPException(status_code=403, detail="Please verify your email before searching")
+    
+    # The first page is a full search; later pages are billed per SEARCH_PAGES_PER_CREDIT
+    if page == 1:
+        cost = 1
+    elif settings.SEARCH_PAGES_PER_CREDIT > 0 and (page - 1) % settings.SEARCH_PAGES_PER_CREDIT == 0:
+        cost = 1
+    else:
+        cost = 0
+    if cost and current_user.searches_remaining < cost:
+        raise HTTPException(
+            status_code=403,
+            detail="Search limit reached. Please upgrade your plan."
+        )
+    
+    try:
+        result = await search_page(
+            q,
+            type,
+            size=size,
+            pit_id=state.get("pit"),
+            search_after=state.get("after"),
+            exact=state.get("exact")
+        )
+        
+        if page == 1:
+            db.add(SearchLog(
+                user_id=current_user.id,
+                query=q,
+                data_type=type,
+                results_count=result["total"],
+                timestamp=datetime.utcnow()
+            ))
+        if cost:
+            current_user.searches_remaining -= cost
+        db.commit()
+        
+        next_cursor = None
+        if result["pit_id"]:
+            next_cursor = create_cursor({
+                "uid": current_user.id,
+                "q": q,
+                "type": type,
+                "page": page,
+                "pit": result["pit_id"],
+                "after": result["search_after"],
+                "exact": result["exact"]
+            })
         
         return {
             "query": q,
-            "type": type or "all",
-            "total_results": total_results,
-            "results_by_type": formatted_results
+            "type": type,
+            "page": page,
+            "total_results": result["total"],
+            "results": result["results"],
+            "next_cursor": next_cursor
         }
     
     except HTTPException:
         raise
+    except PointInTimeExpired:
+        raise HTTPException(status_code=410, detail=CURSOR_EXPIRED)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search error: {str(e)}")
 
@@ -109,6 +466,9 @@ async def get_stats(current_user: User = Depends(get_current_user)):
     """Get Elasticsearch index statistics."""
     try:
         stats = await get_index_stats()
+        stats["cache"] = search_cache.stats()
+        stats["single_flight"] = search_flight.stats()
+        stats["bloom"] = get_bloom_index().stats()
         return stats
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting stats: {str(e)}")
@@ -0,0 +1,115 @@
+"""
+Bounded in-process cache for grouped search results.
+
+Entries expire after a TTL, the least recently used entry is evicted when the
+cache is full, and every entry is tied to the index generation it was read
+from so bulk indexing invalidates everything at once.
+
+SingleFlight covers the gap before an entry exists: concurrent identical
+searches await one in-flight call instead of each querying Elasticsearch.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+
+from app.config import settings
+
+
+def normalize_query(query: str) -> str:
+    """Collapse whitespace and case so trivially different queries share an entry."""
+    return " ".join(query.split()).lower()
+
+
+class SearchCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, generation, results)
+
+    def key(self, query: str, data_type: str = None, fuzzy: bool = False):
+        return (normalize_query(query), data_type or "all", fuzzy)
+
+    def get(self, query: str, data_type: str = None, fuzzy: bool = False):
+        """Return cached results or None on a miss."""
+        key = self.key(query, data_type, fuzzy)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, generation, results = entry
+        if generation != self.generation or expires_at < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return results
+
+    def put(self, query: str, data_type: str, results, generation: int = None, fuzzy: bool = False):
+        """Store results read at the given generation (defaults to the current one)."""
+        if generation is None:
+            generation = self.generation
+        if self.max_size <= 0 or generation != self.generation:
+            # Disabled, or the index changed while the search was in flight
+            return
+        key = self.key(query, data_type, fuzzy)
+        self._entries[key] = (time.monotonic() + self.ttl, generation, results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def bump_generation(self):
+        """Invalidate every entry after the index content changed."""
+        self.generation += 1
+        self._entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "generation": self.generation,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SingleFlight:
+    def __init__(self):
+        self.executed = 0
+        self.coalesced = 0
+        self._calls = {}  # key -> task of the in-flight call
+
+    async def do(self, key, fn):
+        """Run fn() once per key at a time; concurrent callers share its result."""
+        task = self._calls.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self.executed += 1
+
+            def forget(done):
+                if self._calls.get(key) is done:
+                    del self._calls[key]
+
+            task.add_done_callback(forget)
+        # Shielded so one caller disconnecting doesn't cancel the shared call
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+        }
+
+
+search_cache = SearchCache(settings.SEARCH_CACHE_SIZE, settings.SEARCH_CACHE_TTL)
+search_flight = SingleFlight()
@@ -1,107 +1,349 @@
 """
-Excel to Elasticsearch Import Script
-Imports OSINT data from Excel files into Elasticsearch index.
+File to Elasticsearch Import Script
+Imports OSINT data from CSV, NDJSON, Excel, Parquet or Arrow files into Elasticsearch index.
 """
 import sys
 import os
-import pandas as pd
 import argparse
-from datetime import datetime
 import asyncio
+import multiprocessing
+import queue
+import shutil
+import signal
+import threading
+import uuid
+from contextlib import nullcontext
 
 # Add parent directory to path to import app modules
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from app.elasticsearch_client import bulk_index_data
+from app.elasticsearch_client import (
+    bulk_index_data, bulk_load_mode, close_es, create_index_if_not_exists, delete_documents,
+    restore_index_settings, set_backend, use_local_backend,
+)
+from app.local_index import get_local_index
 from app.config import settings
+from app.ingest import DEFAULT_CHUNK_ROWS, aiter_file_documents, file_checksum, plan_shards
+from app.manifest import ManifestRun, aiter_delta_documents, dead_letter_ids
+from app.database import init_db
+from app.bulk import OP_TYPES
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
-def validate_dataframe(df):
-    """Validate that the DataFrame has the required columns."""
-    required_columns = ['type', 'value']
-    optional_columns = ['source', 'additional_info']
-    
-    for col in required_columns:
-        if col not in df.columns:
-            raise ValueError(f"Missing required column: {col}")
-    
-    # Add optional columns if missing
-    for col in optional_columns:
-        if col not in df.columns:
-            df[col] = ""
-    
-    return df
+async def import_from_excel(file_path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS, dead_letter_path: str = None,
+                            concurrency: int = None, op_type: str = None, bulk_mode: bool = False,
+                            force_merge: bool = False, manifest: str = None, delete_missing: bool = False):
+    """
+    Import data from a file in any supported format to Elasticsearch, one chunk at a time.
+    With a manifest, only rows that are new or changed since the manifest's last import are
+    indexed; delete_missing also deletes the documents that are no longer in the file.
+    """
+    try:
+        await create_index_if_not_exists()
+        logger.info(f"Reading file: {file_path}")
+        progress = {"processed": 0, "failed": 0, "total": 0}
 
+        def log_chunk(rows):
+            progress["total"] += rows
+            logger.info(f"Read {progress['total']} rows, indexed {progress['processed']}, failed {progress['failed']}")
 
-def process_dataframe(df):
-    """Process DataFrame and prepare documents for indexing."""
-    df = validate_dataframe(df)
-    
-    documents = []
-    for _, row in df.iterrows():
-        doc = {
-            "type": str(row['type']).lower(),
-            "value": str(row['value']),
-            "source": str(row.get('source', '')),
-            "additional_info": str(row.get('additional_info', '')),
-            "indexed_at": datetime.utcnow().isoformat()
-        }
-        documents.append(doc)
+        run = None
+        if manifest:
+            # Manifests live in the application database, next to the job records
+            init_db()
+            run = ManifestRun(manifest, f"cli_{uuid.uuid4().hex}")
+            checksum = await asyncio.to_thread(file_checksum, file_path)
+            if run.file_unchanged(checksum):
+                logger.info(f"{file_path} is unchanged since the last import of manifest {manifest} "
+                            f"({run.rows} rows), nothing to do")
+                return 0, 0
+            documents = aiter_delta_documents(file_path, run, chunk_rows, progress, on_chunk=log_chunk)
+        else:
+            documents = aiter_file_documents(file_path, chunk_rows=chunk_rows, on_chunk=log_chunk)
+        # Settings are restored on the way out, also when the import fails or is interrupted
+        async with bulk_load_mode(force_merge) if bulk_mode else nullcontext():
+            success, failed = await bulk_index_data(
+                documents, dead_letter_path, progress=progress, concurrency=concurrency, op_type=op_type
+            )
+            if run is not None:
+                deleted = await delete_documents(run.missing_ids()) if delete_missing else 0
+                run.commit(checksum, dead_letter_ids(dead_letter_path) if failed else None)
+        logger.info(f"Successfully indexed {success} documents, {failed} failed")
+        logger.info(
+            f"New: {progress.get('created', 0)}, updated: {progress.get('updated', 0)}, "
+            f"unchanged: {progress.get('unchanged', 0)}"
+        )
+        if run is not None and delete_missing:
+            logger.info(f"Deleted {deleted} documents no longer in the file")
+        if failed:
+            logger.info(f"Rejected documents written to {dead_letter_path}")
+        
+        if use_local_backend():
+            logger.info("Compacting local index segments...")
+            await asyncio.to_thread(get_local_index().compact)
+        
+        return success, failed
     
-    return documents
+    except Exception as e:
+        logger.error(f"Error importing data: {e}")
+        raise
+    finally:
+        await close_es()
 
 
-async def import_from_excel(file_path: str):
-    """Import data from Excel file to Elasticsearch."""
+async def restore_settings():
+    """Undo the settings left behind by a --bulk-mode import that crashed."""
     try:
-        logger.info(f"Reading Excel file: {file_path}")
-        df = pd.read_excel(file_path)
-        logger.info(f"Loaded {len(df)} rows from Excel file")
-        
-        # Process data
-        documents = process_dataframe(df)
-        logger.info(f"Processed {len(documents)} documents for indexing")
-        
-        # Bulk index to Elasticsearch
-        logger.info("Indexing documents to Elasticsearch...")
-        success, failed = await bulk_index_data(documents)
-        logger.info(f"Successfully indexed {success} documents, {failed} failed")
-        
+        restored = await restore_index_settings()
+        if restored is None:
+            logger.info(f"No bulk load settings to restore on {settings.ELASTICSEARCH_WRITE_ALIAS}")
+        else:
+            logger.info(f"Restored {settings.ELASTICSEARCH_WRITE_ALIAS} settings to {restored}")
+        return restored
+    finally:
+        await close_es()
+
+
+async def index_shard(number: int, file_path: str, shard: dict, options: dict) -> dict:
+    progress = {"processed": 0, "failed": 0, "total": 0}
+
+    def log_chunk(rows):
+        progress["total"] += rows
+        logger.info(
+            f"Shard {number}: read {progress['total']} rows, indexed {progress['processed']}, failed {progress['failed']}"
+        )
+
+    # SIGTERM from the parent cancels the import, so files and the client are closed on the way out
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    try:
+        documents = aiter_file_documents(file_path, chunk_rows=options["chunk_rows"], on_chunk=log_chunk, shard=shard)
+        await bulk_index_data(
+            documents, options["dead_letter"], progress=progress, concurrency=options["concurrency"],
+            op_type=options["op_type"]
+        )
+        return progress
+    finally:
+        await close_es()
+
+
+def worker_settings(workers: int) -> dict:
+    """The settings as resolved in the parent, with the ingest rate caps shared between the workers."""
+    resolved = settings.model_dump()
+    for key in ("INGEST_MAX_DOCS_PER_SEC", "INGEST_MAX_BYTES_PER_SEC"):
+        if resolved[key] > 0:
+            resolved[key] = resolved[key] / workers
+    return resolved
+
+
+def import_shard(number: int, file_path: str, shard: dict, options: dict, results):
+    """Worker process entry point: index one shard with its own client and report its counts."""
+    for key, value in options["settings"].items():
+        setattr(settings, key, value)
+    set_backend(options["backend"])
+    try:
+        results.put((number, asyncio.run(index_shard(number, file_path, shard, options)), None))
+    except asyncio.CancelledError:
+        results.put((number, None, "interrupted"))
+    except Exception as e:
+        results.put((number, None, str(e)))
+
+
+def merge_dead_letters(dead_letter_path: str, count: int):
+    """Append the per-shard dead-letter files to dead_letter_path and remove them."""
+    parts = [f"{dead_letter_path}.{number}" for number in range(count)]
+    parts = [part for part in parts if os.path.exists(part)]
+    if not parts:
+        return
+    with open(dead_letter_path, "a") as out:
+        for part in parts:
+            with open(part) as f:
+                shutil.copyfileobj(f, out)
+            os.remove(part)
+
+
+def start_workers(file_path: str, shards: list, options: dict, processes: list):
+    """Spawn one worker process per shard into processes; returns the queue their results arrive on."""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    # Workers start with Ctrl-C ignored, so only the parent reacts to it and stops them with SIGTERM
+    handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        for number, shard in enumerate(shards):
+            shard_options = dict(options, dead_letter=f"{options['dead_letter']}.{number}")
+            process = context.Process(
+                target=import_shard, args=(number, file_path, shard, shard_options, results), daemon=True
+            )
+            process.start()
+            processes.append(process)
+    finally:
+        signal.signal(signal.SIGINT, handler)
+    return results
+
+
+def wait_for_workers(processes: list, results, stop: threading.Event) -> dict:
+    """Sum the progress counts reported by the workers; raises as soon as one fails."""
+    totals = {}
+    pending = set(range(len(processes)))
+    while pending and not stop.is_set():
+        # Checked before waiting: a worker that exited has already flushed its result
+        exited = [number for number in pending if processes[number].exitcode is not None]
+        try:
+            number, counts, error = results.get(timeout=1)
+        except queue.Empty:
+            if exited:
+                raise RuntimeError(f"Shard {exited[0]} worker exited with code {processes[exited[0]].exitcode}")
+            continue
+        pending.discard(number)
+        if error:
+            raise RuntimeError(f"Shard {number} failed: {error}")
+        for key, value in counts.items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def stop_workers(processes: list):
+    """Terminate workers that are still running and wait for all of them to exit."""
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join(timeout=30)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+
+async def import_sharded(file_path: str, shards: list, options: dict, bulk_mode: bool = False,
+                         force_merge: bool = False):
+    """Import the shards of a file in parallel worker processes, one Elasticsearch client each."""
+    try:
+        await create_index_if_not_exists()
+        logger.info(f"Importing {file_path} in {len(shards)} worker processes")
+        async with bulk_load_mode(force_merge) if bulk_mode else nullcontext():
+            processes = []
+            stop = threading.Event()
+            try:
+                results = start_workers(file_path, shards, options, processes)
+                totals = await asyncio.to_thread(wait_for_workers, processes, results, stop)
+            finally:
+                # Also on failure or Ctrl-C: no worker outlives the import
+                stop.set()
+                stop_workers(processes)
+                merge_dead_letters(options["dead_letter"], len(shards))
+        success, failed = totals.get("processed", 0), totals.get("failed", 0)
+        logger.info(f"Read {totals.get('total', 0)} rows: indexed {success} documents, {failed} failed")
+        logger.info(
+            f"New: {totals.get('created', 0)}, updated: {totals.get('updated', 0)}, "
+            f"unchanged: {totals.get('unchanged', 0)}"
+        )
+        if failed:
+            logger.info(f"Rejected documents written to {options['dead_letter']}")
         return success, failed
-    
     except Exception as e:
         logger.error(f"Error importing data: {e}")
         raise
+    finally:
+        await close_es()
 
 
 def main():
-    parser = argparse.ArgumentParser(description='Import OSINT data from Excel to Elasticsearch')
-    parser.add_argument('--file', '-f', required=True, help='Path to Excel file')
+    parser = argparse.ArgumentParser(description='Import OSINT data from a file to Elasticsearch')
+    parser.add_argument('--file', '-f', help='Path to a CSV/NDJSON (optionally .gz/.zst), Excel, Parquet or Arrow file')
     parser.add_argument('--host', help='Elasticsearch host (overrides config)')
+    parser.add_argument('--backend', choices=['elasticsearch', 'local'], default='elasticsearch',
+                        help='Index into Elasticsearch or build the embedded local index')
+    parser.add_argument('--local-index', help='Local index directory (overrides config)')
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS,
+                        help='Rows read and indexed per chunk')
+    parser.add_argument('--op-type', choices=OP_TYPES,
+                        help='create skips rows already indexed, index overwrites them, update upserts '
+                        '(default: BULK_OP_TYPE)')
+    parser.add_argument('--concurrency', type=int,
+                        help='Bulk requests in flight at once, per worker (overrides config)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Parse and index in this many processes, each taking a shard of the file '
+                        '(uncompressed CSV/NDJSON, Parquet or Arrow IPC files)')
+    parser.add_argument('--dead-letter', help='NDJSON file for rejected documents '
+                        '(default: <DEAD_LETTER_DIR>/<file name>.ndjson)')
+    parser.add_argument('--manifest',
+                        help='Name of the data feed; only rows new or changed since its last import are indexed')
+    parser.add_argument('--delete-missing', action='store_true',
+                        help='With --manifest, delete documents from the last import that are not in this file')
+    parser.add_argument('--bulk-mode', action='store_true',
+                        help='Disable refresh and replicas during the import, restoring them afterwards')
+    parser.add_argument('--force-merge', action='store_true',
+                        help='With --bulk-mode, force-merge the index once the import is done')
+    parser.add_argument('--restore-settings', action='store_true',
+                        help='Only restore the index settings left behind by a crashed --bulk-mode import')
     
     args = parser.parse_args()
     
     # Override Elasticsearch host if provided
     if args.host:
-        import os
-        os.environ['ELASTICSEARCH_HOST'] = args.host
+        settings.ELASTICSEARCH_HOST = args.host
+    if args.local_index:
+        settings.LOCAL_INDEX_DIR = args.local_index
+    set_backend(args.backend)
+    
+    if args.restore_settings:
+        asyncio.run(restore_settings())
+        sys.exit(0)
+    if not args.file:
+        parser.error("--file is required")
+    if args.delete_missing and not args.manifest:
+        parser.error("--delete-missing needs --manifest")
+    if args.workers > 1 and args.manifest:
+        parser.error("--manifest imports run in one process, drop --workers")
+    if args.workers > 1 and use_local_backend():
+        parser.error("--workers needs the Elasticsearch backend; the local index has a single writer")
+    dead_letter_path = args.dead_letter or os.path.join(
+        settings.DEAD_LETTER_DIR, f"{os.path.basename(args.file)}.ndjson"
+    )
     
     if not os.path.exists(args.file):
         logger.error(f"File not found: {args.file}")
         sys.exit(1)
     
     logger.info("Starting data import...")
-    logger.info(f"Elasticsearch host: {settings.ELASTICSEARCH_HOST}")
-    logger.info(f"Target index: {settings.ELASTICSEARCH_INDEX}")
+    if use_local_backend():
+        logger.info(f"Target local index: {settings.LOCAL_INDEX_DIR}")
+    else:
+        logger.info(f"Elasticsearch host: {settings.ELASTICSEARCH_HOST}")
+        logger.info(f"Target index: {settings.ELASTICSEARCH_WRITE_ALIAS}")
+    
+    shards = plan_shards(args.file, count=args.workers)
+    if args.workers > 1 and len(shards) == 1:
+        logger.warning(f"{args.file} can't be split into shards, importing it in one process")
     
+    # Treat SIGTERM like Ctrl-C so bulk-mode settings are restored on the way out
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
     try:
-        success, failed = asyncio.run(import_from_excel(args.file))
+        if len(shards) > 1:
+            options = {
+                "chunk_rows": args.chunk_rows,
+                "concurrency": args.concurrency,
+                "op_type": args.op_type,
+                "dead_letter": dead_letter_path,
+                "backend": args.backend,
+                # Workers are spawned fresh, so the settings resolved here, overrides included, are handed down
+                "settings": worker_settings(len(shards)),
+            }
+            success, failed = asyncio.run(import_sharded(
+                args.file, shards, options, args.bulk_mode, args.force_merge
+            ))
+        else:
+            success, failed = asyncio.run(import_from_excel(
+                args.file, args.chunk_rows, dead_letter_path, args.concurrency, args.op_type,
+                args.bulk_mode, args.force_merge, args.manifest, args.delete_missing
+            ))
         logger.info(f"Import completed: {success} successful, {failed} failed")
         sys.exit(0 if failed == 0 else 1)
+    except KeyboardInterrupt:
+        logger.error("Import interrupted")
+        sys.exit(130)
     except Exception as e:
         logger.error(f"Import failed: {e}")
         sys.exit(1)
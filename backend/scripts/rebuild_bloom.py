@@ -0,0 +1,56 @@
+"""
+Bloom Filter Rebuild Script
+Rebuilds the per-type Bloom filters from every document in the index.
+"""
+import sys
+import os
+import argparse
+import asyncio
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.elasticsearch_client import rebuild_bloom_filters, close_es, set_backend
+from app.bloom import get_bloom_index
+from app.config import settings
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+async def rebuild():
+    try:
+        return await rebuild_bloom_filters()
+    finally:
+        await close_es()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the Bloom filters used to skip searches for absent identifiers')
+    parser.add_argument('--host', help='Elasticsearch host (overrides config)')
+    parser.add_argument('--backend', choices=['elasticsearch', 'local'], default='elasticsearch',
+                        help='Read documents from Elasticsearch or the embedded local index')
+    parser.add_argument('--local-index', help='Local index directory (overrides config)')
+    
+    args = parser.parse_args()
+    
+    if args.host:
+        settings.ELASTICSEARCH_HOST = args.host
+    if args.local_index:
+        settings.LOCAL_INDEX_DIR = args.local_index
+    set_backend(args.backend)
+    
+    logger.info(f"Rebuilding Bloom filters in {settings.BLOOM_DIR}...")
+    try:
+        count = asyncio.run(rebuild())
+        for data_type, stats in get_bloom_index().stats()["types"].items():
+            logger.info(f"{data_type}: {stats['values']} values, estimated false-positive rate {stats['estimated_fp_rate']}")
+        logger.info(f"Rebuild completed from {count} documents")
+    except Exception as e:
+        logger.error(f"Rebuild failed: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Zero-Downtime Reindex Script
+Builds the next osint_data_v{n} index with the current mapping, fills it from the live
+index (throttled _reindex) or from a file, and swaps the read alias to it atomically.
+The previous version is kept so --rollback can switch back.
+"""
+import sys
+import os
+import argparse
+import asyncio
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.elasticsearch_client import (
+    bulk_index_data, bulk_load_mode, close_es, get_alias_target, get_es, get_index_versions,
+    index_definition, swap_aliases, versioned_index_name,
+)
+from app.config import settings
+from app.ingest import DEFAULT_CHUNK_ROWS, aiter_file_documents
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+async def copy_with_reindex(source: str, dest: str, requests_per_second: float):
+    """Run a throttled server-side _reindex and log its progress until it finishes."""
+    es = get_es()
+    # Routing follows the new layout, not the source's
+    script = {"source": "ctx._routing = ctx._source.type"} if settings.ELASTICSEARCH_ROUTE_BY_TYPE else None
+    response = await es.reindex(
+        source={"index": source},
+        # Documents written through the write alias meanwhile are newer, keep them
+        dest={"index": dest, "op_type": "create"},
+        script=script,
+        conflicts="proceed",
+        requests_per_second=requests_per_second,
+        slices="auto",
+        wait_for_completion=False,
+    )
+    task_id = response["task"]
+    logger.info(f"Started _reindex {source} -> {dest} (task {task_id})")
+    while True:
+        await asyncio.sleep(5)
+        task = await es.tasks.get(task_id=task_id)
+        status = task["task"]["status"]
+        logger.info(f"Copied {status['created']} of {status['total']} documents")
+        if task["completed"]:
+            failures = task.get("response", {}).get("failures") or []
+            if task.get("error") or failures:
+                raise RuntimeError(f"_reindex failed: {task.get('error') or failures[:3]}")
+            return status["created"]
+
+
+async def reindex(file_path: str = None, requests_per_second: float = None, replace_legacy: bool = False):
+    es = get_es()
+    try:
+        source = await get_alias_target(settings.ELASTICSEARCH_INDEX)
+        if source is None and file_path is None:
+            raise RuntimeError(f"{settings.ELASTICSEARCH_INDEX} does not exist, nothing to reindex")
+        if source == settings.ELASTICSEARCH_INDEX and not replace_legacy:
+            raise RuntimeError(
+                f"{source} is an index created before versioning; swapping it for an alias deletes it, "
+                f"so there is no rollback. Pass --replace-legacy to go ahead."
+            )
+        previous_writer = await get_alias_target(settings.ELASTICSEARCH_WRITE_ALIAS)
+
+        new_index = versioned_index_name(max(await get_index_versions(), default=0) + 1)
+        await es.indices.create(index=new_index, body=index_definition())
+        logger.info(f"Created {new_index}")
+
+        # New writes go to the new version from here on, so the copy can't miss them
+        await swap_aliases(new_index, read=False)
+        try:
+            async with bulk_load_mode(index_name=new_index):
+                if file_path:
+                    documents = aiter_file_documents(file_path, chunk_rows=DEFAULT_CHUNK_ROWS)
+                    copied, failed = await bulk_index_data(documents, index_name=new_index)
+                    if failed:
+                        raise RuntimeError(f"{failed} documents failed to index into {new_index}")
+                else:
+                    copied = await copy_with_reindex(source, new_index, requests_per_second)
+        except BaseException:
+            if previous_writer is not None:
+                await swap_aliases(previous_writer, read=False)
+            logger.error(f"Reindex failed; writes go to {previous_writer} again, {new_index} left for inspection")
+            raise
+
+        await swap_aliases(new_index)
+        logger.info(f"{settings.ELASTICSEARCH_INDEX} now serves {new_index} ({copied} documents copied)")
+        if source and source != settings.ELASTICSEARCH_INDEX:
+            logger.info(f"Previous version {source} kept for --rollback")
+        return new_index
+    finally:
+        await close_es()
+
+
+async def rollback():
+    """Point both aliases back at the newest version older than the current one."""
+    try:
+        current = await get_alias_target(settings.ELASTICSEARCH_INDEX)
+        versions = await get_index_versions()
+        current_version = next((v for v in versions if versioned_index_name(v) == current), None)
+        older = [v for v in versions if current_version is not None and v < current_version]
+        if not older:
+            raise RuntimeError(f"No version older than {current} to roll back to")
+        previous = versioned_index_name(older[-1])
+        await swap_aliases(previous)
+        logger.warning(f"Rolled back to {previous}; documents written to {current} since the swap are not in it")
+        return previous
+    finally:
+        await close_es()
+
+
+async def list_versions():
+    try:
+        read = await get_alias_target(settings.ELASTICSEARCH_INDEX)
+        write = await get_alias_target(settings.ELASTICSEARCH_WRITE_ALIAS)
+        for version in await get_index_versions():
+            name = versioned_index_name(version)
+            marks = [label for label, target in (("read", read), ("write", write)) if target == name]
+            logger.info(f"{name} {' '.join(marks)}")
+    finally:
+        await close_es()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the OSINT index as a new version and swap it in')
+    parser.add_argument('--host', help='Elasticsearch host (overrides config)')
+    parser.add_argument('--file', '-f', help='Re-import this file instead of copying the live index with _reindex')
+    parser.add_argument('--requests-per-second', type=float, default=settings.REINDEX_REQUESTS_PER_SECOND,
+                        help='_reindex throttle, -1 for unthrottled (default: REINDEX_REQUESTS_PER_SECOND)')
+    parser.add_argument('--replace-legacy', action='store_true',
+                        help='Allow replacing an unversioned index named like the read alias (deletes it)')
+    parser.add_argument('--rollback', action='store_true', help='Switch the aliases back to the previous version')
+    parser.add_argument('--list', action='store_true', help='List index versions and where the aliases point')
+
+    args = parser.parse_args()
+
+    if args.host:
+        settings.ELASTICSEARCH_HOST = args.host
+    if args.file and not os.path.exists(args.file):
+        logger.error(f"File not found: {args.file}")
+        sys.exit(1)
+
+    try:
+        if args.list:
+            asyncio.run(list_versions())
+        elif args.rollback:
+            asyncio.run(rollback())
+        else:
+            asyncio.run(reindex(args.file, args.requests_per_second, args.replace_legacy))
+    except KeyboardInterrupt:
+        logger.error("Reindex interrupted")
+        sys.exit(130)
+    except Exception as e:
+        logger.error(f"Reindex failed: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
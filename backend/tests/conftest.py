@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# Tests import the backend the same way the scripts do
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# A throwaway database, set before app.database creates its engine
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}")
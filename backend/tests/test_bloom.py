@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+from app import elasticsearch_client
+from app.bloom import BloomIndex
+from app.config import settings
+
+
+@pytest.fixture(autouse=True)
+def small_filters(monkeypatch):
+    monkeypatch.setattr(settings, "BLOOM_ENABLED", True)
+    monkeypatch.setattr(settings, "BLOOM_CAPACITY", 1000)
+
+
+class FakeES:
+    """Every search comes back empty, with the given response fields."""
+
+    def __init__(self, response):
+        self.response = response
+
+    def options(self, **kwargs):
+        return self
+
+    async def search(self, **kwargs):
+        return dict(self.response, aggregations={"by_type": {"buckets": []}})
+
+
+def recheck(bloom: BloomIndex):
+    """Skip the few seconds maybe_reload waits between looks at the disk."""
+    bloom._last_reload_check = 0.0
+
+
+def test_reader_picks_up_filters_completed_after_it_started(tmp_path):
+    reader = BloomIndex(str(tmp_path))
+    assert reader.might_contain("email", "absent@example.com")
+
+    rebuild = BloomIndex(str(tmp_path))
+    rebuild.add("email", "known@example.com")
+    rebuild.complete = True
+    rebuild.save(merge=False)
+    recheck(reader)
+
+    assert reader.might_contain("email", "known@example.com")
+    assert not reader.might_contain("email", "absent@example.com")
+
+
+def test_values_being_loaded_elsewhere_are_not_rejected(tmp_path):
+    rebuild = BloomIndex(str(tmp_path))
+    rebuild.complete = True
+    rebuild.save(merge=False)
+    reader = BloomIndex(str(tmp_path))
+    writer = BloomIndex(str(tmp_path))
+
+    async def load():
+        async with writer.writing():
+            writer.add("email", "new@example.com")
+            recheck(reader)
+            # Not saved yet, but the writer's marker keeps the reader from rejecting it
+            assert reader.might_contain("email", "new@example.com")
+            # The writer's own filter is current
+            assert not writer.might_contain("email", "other@example.com")
+
+    asyncio.run(load())
+    recheck(reader)
+
+    assert reader.might_contain("email", "new@example.com")
+    assert not reader.might_contain("email", "other@example.com")
+
+
+def test_markers_of_crashed_writers_expire(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "BLOOM_WRITER_TIMEOUT", 0)
+    rebuild = BloomIndex(str(tmp_path))
+    rebuild.complete = True
+    rebuild.save(merge=False)
+    (tmp_path / "writer-crashed").touch()
+    reader = BloomIndex(str(tmp_path))
+
+    assert not reader.might_contain("email", "absent@example.com")
+
+
+def test_nested_loads_save_once(tmp_path, monkeypatch):
+    writer = BloomIndex(str(tmp_path))
+    saves = []
+    monkeypatch.setattr(writer, "save", lambda: saves.append(len(list(tmp_path.glob("writer-*")))))
+
+    async def load():
+        async with writer.writing():
+            async with writer.writing():
+                writer.add("email", "new@example.com")
+            assert saves == []
+
+    asyncio.run(load())
+
+    # Saved once, before the marker was removed
+    assert saves == [1]
+    assert list(tmp_path.glob("writer-*")) == []
+
+
+def test_false_positives_are_only_counted_for_consulted_filters(tmp_path, monkeypatch):
+    monkeypatch.setattr(elasticsearch_client, "get_bloom_index", lambda: bloom)
+    bloom = BloomIndex(str(tmp_path))
+
+    async def search(query, timed_out=False):
+        response = {"took": 1, "timed_out": timed_out}
+        monkeypatch.setattr(elasticsearch_client, "get_es", lambda: FakeES(response))
+        return await elasticsearch_client.search_data(query, "email")
+
+    # Incomplete filters are not consulted, so an empty exact lookup says nothing about them
+    asyncio.run(search("known@example.com"))
+    assert bloom.stats()["types"]["email"]["false_positives"] == 0
+
+    bloom.add("email", "known@example.com")
+    bloom.complete = True
+    asyncio.run(search("known@example.com", timed_out=True))
+    assert bloom.stats()["types"]["email"]["false_positives"] == 0
+
+    asyncio.run(search("known@example.com"))
+    stats = bloom.stats()["types"]["email"]
+    assert (stats["checks"], stats["rejected"], stats["false_positives"]) == (2, 0, 1)
+
+
+def test_rebuild_keeps_values_saved_meanwhile_and_waits_for_writers(tmp_path):
+    rebuild = BloomIndex(str(tmp_path))
+    rebuild.reset()
+    rebuild.add("email", "scanned@example.com")
+    importer = BloomIndex(str(tmp_path))
+    importer.add("email", "imported@example.com")
+    importer.save()
+    rebuild.complete = True
+    rebuild.save()
+
+    reader = BloomIndex(str(tmp_path))
+    assert reader.might_contain("email", "scanned@example.com")
+    assert reader.might_contain("email", "imported@example.com")
+
+    (tmp_path / "writer-importer").touch()
+    with pytest.raises(RuntimeError):
+        BloomIndex(str(tmp_path)).reset()
@@ -0,0 +1,67 @@
+import asyncio
+import json
+
+import pandas as pd
+from elasticsearch import ConnectionError as ESConnectionError
+
+from app import bulk
+from app.config import settings
+from app.ingest import document_id, document_keys, prepare_frame
+
+
+class FlakyClient:
+    """Creates the first document, rejects the second, asks to retry the third, then drops the connection."""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def bulk(self, operations):
+        self.calls += 1
+        if self.calls > 1:
+            raise ESConnectionError("connection reset")
+        return {"items": [
+            {"create": {"status": 201, "result": "created"}},
+            {"create": {"status": 400, "error": {"type": "mapper_parsing_exception"}}},
+            {"create": {"status": 429, "error": {"type": "es_rejected_execution_exception"}}},
+        ]}
+
+
+def test_every_document_is_indexed_or_dead_lettered(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "BULK_MAX_RETRIES", 1)
+    monkeypatch.setattr(settings, "BULK_INITIAL_BACKOFF", 0)
+    chunk = [{"type": "email", "value": f"user{i}@example.com"} for i in range(3)]
+    lines = [bulk.serialize(doc, "osint_data_write", "create") for doc in chunk]
+    dead_letter = bulk.DeadLetter(str(tmp_path / "dead.ndjson"))
+
+    counts = asyncio.run(bulk.send_chunk(FlakyClient(), chunk, lines, dead_letter))
+    dead_letter.close()
+
+    with open(tmp_path / "dead.ndjson") as f:
+        rejected = [json.loads(line) for line in f]
+    assert counts["created"] == 1
+    assert counts["failed"] == 2
+    assert [entry["document"] for entry in rejected] == chunk[1:]
+    assert [entry["status"] for entry in rejected] == [400, None]
+
+
+def test_masked_and_junk_values_keep_distinct_ids():
+    def doc_id(dtype, value):
+        return document_id({"type": dtype, "value": value, "source": "leak"})
+
+    # Normalizing drops the masked digits and the letters, which would collapse these
+    assert doc_id("phone", "98XXXXXX10") != doc_id("phone", "98YYYYYY10")
+    assert doc_id("phone", "N/A") != doc_id("phone", "unknown")
+    # Formatting variants of one identifier still share an _id
+    assert doc_id("phone", "+91 98765 43210") == doc_id("phone", "09876543210")
+    assert doc_id("phone", "0044 20 7946 0958") == doc_id("phone", "+442079460958")
+    assert doc_id("email", " Alice@Example.com") == doc_id("email", "alice@example.com")
+
+
+def test_document_keys_match_document_id():
+    frame = prepare_frame(pd.DataFrame({
+        "type": ["phone", "phone", "email"],
+        "value": ["98XXXXXX10", "+91 98765 43210", "Alice@Example.com"],
+        "source": ["leak", "leak", "Leak "],
+    }))
+
+    assert [key.hex() for key in document_keys(frame)] == [document_id(doc) for doc in frame.to_dict("records")]
@@ -0,0 +1,95 @@
+import queue
+import sys
+
+import pytest
+
+from app import elasticsearch_client
+from app.config import settings
+from app.ingest import has_quoted_newlines, plan_shards
+from scripts import import_data
+
+
+class FakeIndices:
+    def __init__(self, meta):
+        self.meta = meta
+        self.put_settings_calls = []
+
+    async def get_mapping(self, index):
+        return {"osint_data_v1": {"mappings": {"_meta": self.meta}}}
+
+    async def put_settings(self, index, settings):
+        self.put_settings_calls.append(settings)
+
+    async def put_mapping(self, index, meta):
+        self.meta = meta
+
+    async def refresh(self, index):
+        pass
+
+
+class FakeES:
+    def __init__(self, meta):
+        self.indices = FakeIndices(meta)
+
+
+def run_restore_flag(monkeypatch, es):
+    monkeypatch.setattr(elasticsearch_client, "get_es", lambda: es)
+    monkeypatch.setattr(sys, "argv", ["import_data.py", "--restore-settings"])
+    with pytest.raises(SystemExit) as exit_info:
+        import_data.main()
+    return exit_info.value.code
+
+
+def test_restore_settings_flag_puts_back_saved_settings(monkeypatch):
+    es = FakeES({"bulk_load": {"refresh_interval": "5s", "number_of_replicas": "1"}})
+
+    assert run_restore_flag(monkeypatch, es) == 0
+    assert es.indices.put_settings_calls == [{"index": {"refresh_interval": "5s", "number_of_replicas": "1"}}]
+    assert es.indices.meta == {}
+
+
+def test_restore_settings_flag_without_saved_settings(monkeypatch):
+    es = FakeES({})
+
+    assert run_restore_flag(monkeypatch, es) == 0
+    assert es.indices.put_settings_calls == []
+
+
+def test_csv_with_line_breaks_in_quoted_values_is_not_split(tmp_path):
+    plain = tmp_path / "plain.csv"
+    plain.write_text("type,value\n" + "".join(f'email,"user{i}@example.com"\n' for i in range(100)))
+    multiline = tmp_path / "multiline.csv"
+    multiline.write_text(
+        'type,value,additional_info\n'
+        + "".join(f'email,user{i}@example.com,"said ""hi""\nthen left"\n' for i in range(100))
+    )
+
+    assert len(plan_shards(str(plain), count=4)) == 4
+    assert len(plan_shards(str(multiline), count=4)) == 1
+    assert not has_quoted_newlines(str(plain), block_size=7)
+    assert has_quoted_newlines(str(multiline), block_size=7)
+
+
+def test_workers_get_the_parents_settings_and_backend(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "ELASTICSEARCH_WRITE_ALIAS", "feed_write")
+    monkeypatch.setattr(settings, "INGEST_MAX_DOCS_PER_SEC", 1000)
+    monkeypatch.setattr(settings, "INGEST_MAX_BYTES_PER_SEC", 0)
+    options = {"settings": import_data.worker_settings(4), "backend": "local"}
+    # Stand in for a freshly spawned worker, whose settings come from the environment
+    monkeypatch.setattr(settings, "ELASTICSEARCH_WRITE_ALIAS", "osint_data_write")
+    monkeypatch.setattr(elasticsearch_client, "_backend", "elasticsearch")
+    seen = {}
+
+    async def index_shard(number, file_path, shard, options):
+        seen.update(
+            alias=settings.ELASTICSEARCH_WRITE_ALIAS,
+            docs_per_sec=settings.INGEST_MAX_DOCS_PER_SEC,
+            bytes_per_sec=settings.INGEST_MAX_BYTES_PER_SEC,
+            local=elasticsearch_client.use_local_backend(),
+        )
+        return {}
+
+    monkeypatch.setattr(import_data, "index_shard", index_shard)
+    import_data.import_shard(0, str(tmp_path / "file.csv"), {}, options, queue.Queue())
+
+    assert seen == {"alias": "feed_write", "docs_per_sec": 250, "bytes_per_sec": 0, "local": True}
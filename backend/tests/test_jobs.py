@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from app import jobs
+from app.config import settings
+from app.database import SessionLocal, init_db
+from app.models import IngestJob, SearchLog, User
+
+
+@pytest.fixture
+def owner(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "JOB_RESULTS_DIR", str(tmp_path / "results"))
+    monkeypatch.setattr(settings, "ENRICH_BATCH_SIZE", 2)
+    init_db()
+    db = SessionLocal()
+    user = User(email=f"{tmp_path.name}@example.com", plan_type="investigator", is_verified=True, searches_remaining=5)
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+    return user_id
+
+
+async def fake_msearch(pairs, fuzzy=False):
+    return [{"email": {"count": 1, "results": [{"value": query}]}} for query, _ in pairs]
+
+
+def enrich_job(tmp_path, owner: int, values: list) -> IngestJob:
+    path = tmp_path / "identifiers.csv"
+    path.write_text("value\n" + "\n".join(values) + "\n")
+    job_id = jobs.new_job_id()
+    jobs.create_job(job_id, "enrich", owner, path.name, str(path), None)
+    return jobs.get_job(job_id)
+
+
+def searches_remaining(user_id: int) -> int:
+    db = SessionLocal()
+    try:
+        return db.get(User, user_id).searches_remaining
+    finally:
+        db.close()
+
+
+def logged_queries(user_id: int) -> list:
+    db = SessionLocal()
+    try:
+        return sorted(log.query for log in db.query(SearchLog).filter(SearchLog.user_id == user_id))
+    finally:
+        db.close()
+
+
+def test_enrichment_charges_and_logs_every_identifier(monkeypatch, tmp_path, owner):
+    monkeypatch.setattr(jobs, "msearch_data", fake_msearch)
+    job = enrich_job(tmp_path, owner, ["a@example.com", "b@example.com", "c@example.com"])
+
+    asyncio.run(jobs.run_enrich(job))
+
+    assert searches_remaining(owner) == 2
+    assert logged_queries(owner) == ["a@example.com", "b@example.com", "c@example.com"]
+    assert jobs.get_job(job.id).matched == 3
+
+
+def test_enrichment_stops_when_searches_run_out(monkeypatch, tmp_path, owner):
+    monkeypatch.setattr(jobs, "msearch_data", fake_msearch)
+    job = enrich_job(tmp_path, owner, [f"user{i}@example.com" for i in range(8)])
+
+    with pytest.raises(jobs.SearchLimitReached):
+        asyncio.run(jobs.run_enrich(job))
+
+    # Two batches of two were paid for, the third batch was not
+    assert searches_remaining(owner) == 1
+    assert len(logged_queries(owner)) == 4
+    assert jobs.get_job(job.id).matched == 4
+
+
+def test_enrichment_rejects_files_over_the_row_cap(monkeypatch, tmp_path, owner):
+    monkeypatch.setattr(jobs, "msearch_data", fake_msearch)
+    monkeypatch.setattr(settings, "ENRICH_MAX_ROWS", 2)
+    job = enrich_job(tmp_path, owner, ["a@example.com", "b@example.com", "c@example.com"])
+
+    with pytest.raises(ValueError):
+        asyncio.run(jobs.run_enrich(job))
+
+    assert searches_remaining(owner) == 5
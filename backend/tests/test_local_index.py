@@ -0,0 +1,66 @@
+import asyncio
+
+from app import bloom, elasticsearch_client, local_index
+from app.config import settings
+from app.local_index import LocalIndex
+
+
+def test_small_adds_are_merged_into_few_segments(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "LOCAL_MERGE_FACTOR", 3)
+    index = LocalIndex(str(tmp_path))
+
+    for batch in range(30):
+        index.add_documents([
+            {"type": "email", "value": f"user{batch}_{i}@example.com", "source": "test"} for i in range(4)
+        ])
+
+    assert index.count() == 120
+    # At most factor - 1 segments per size tier are left unmerged
+    assert len(index.segments) <= 6
+    grouped = index.search_tier("substring", "user0_3@")
+    assert grouped["email"]["count"] == 1
+
+
+def test_readers_see_segments_written_and_merged_by_another_writer(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "LOCAL_MERGE_FACTOR", 2)
+    reader = LocalIndex(str(tmp_path))
+    writer = LocalIndex(str(tmp_path))
+
+    writer.add_documents([{"type": "email", "value": "first@example.com", "source": "test"}])
+    assert reader.search_tier("substring", "first@")["email"]["count"] == 1
+
+    # Merges the two segments into one and deletes them
+    writer.add_documents([{"type": "email", "value": "second@example.com", "source": "test"}])
+    assert reader.search_tier("substring", "@example")["email"]["count"] == 2
+    assert len(reader.segments) == 1
+
+
+def test_fuzzy_finds_two_edits_in_short_queries(tmp_path):
+    index = LocalIndex(str(tmp_path))
+    index.add_documents([{"type": "username", "value": "johns", "source": "test"}])
+
+    # No trigram in common, but within two edits
+    assert index.search_tier("fuzzy", "jonhs")["username"]["count"] == 1
+
+
+def test_search_functions_dispatch_to_the_local_backend(monkeypatch, tmp_path):
+    monkeypatch.setattr(local_index, "_local_index", LocalIndex(str(tmp_path / "index")))
+    monkeypatch.setattr(bloom, "_bloom_index", bloom.BloomIndex(str(tmp_path / "bloom")))
+    monkeypatch.setattr(elasticsearch_client, "_backend", "local")
+
+    async def run():
+        await elasticsearch_client.bulk_index_data([
+            {"type": "email", "value": "alice@example.com", "source": "test"},
+            {"type": "username", "value": "alice_w", "source": "test"},
+        ])
+        single = await elasticsearch_client.search_data("alice")
+        batch = await elasticsearch_client.msearch_data([("alice", None), ("alice@example.com", "email")])
+        page = await elasticsearch_client.search_page("alice", "username")
+        return single, batch, page
+
+    single, batch, page = asyncio.run(run())
+
+    assert {dtype: group["count"] for dtype, group in single.items()} == {"email": 1, "username": 1}
+    assert batch[0] == single
+    assert batch[1]["email"]["count"] == 1
+    assert page["results"][0]["value"] == "alice_w"
@@ -0,0 +1,47 @@
+import pytest
+
+from app import elasticsearch_client
+from app.normalizers import classify_identifier
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("9876543210", ("phone", "+919876543210")),
+    ("09876543210", ("phone", "+919876543210")),
+    ("+44 20 7946 0958", ("phone", "+442079460958")),
+    ("0044 20 7946 0958", ("phone", "+442079460958")),
+    ("(+91) 98765 43210", ("phone", "+919876543210")),
+])
+def test_full_phone_numbers_are_identifiers(query, expected):
+    assert classify_identifier(query) == expected
+
+
+@pytest.mark.parametrize("query", ["98765432", "987654321", "98765432101", "919876543210"])
+def test_partial_digit_runs_are_not_phone_numbers(query):
+    assert classify_identifier(query) is None
+    assert classify_identifier(query, "phone") is None
+
+
+class RejectingBloom:
+    def check(self, data_type, value):
+        return False
+
+
+def test_partial_phone_falls_through_to_substring_tiers(monkeypatch):
+    monkeypatch.setattr(elasticsearch_client, "get_bloom_index", lambda: RejectingBloom())
+
+    identifier, tiers, _ = elasticsearch_client.plan_tiers("98765432")
+
+    assert identifier is None
+    assert "substring" in tiers
+
+
+def test_bloom_rejection_only_skips_the_exact_tier(monkeypatch):
+    monkeypatch.setattr(elasticsearch_client, "get_bloom_index", lambda: RejectingBloom())
+
+    # Not indexed as a phone number, but part of the UPI ID 9876543210@paytm
+    identifier, tiers, bloom_passed = elasticsearch_client.plan_tiers("9876543210")
+
+    assert identifier == ("phone", "+919876543210")
+    assert tiers == ["phrase", "substring"]
+    assert not bloom_passed
+    assert elasticsearch_client.plan_tiers("9876543210", "phone")[1] == []
@@ -0,0 +1,79 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from elasticsearch import NotFoundError
+from elastic_transport import ApiResponseMeta, HttpHeaders, NodeConfig
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from app import elasticsearch_client, search
+from app.auth import create_access_token, get_current_user, verify_token
+from app.config import settings
+
+
+def expired_pit_error():
+    meta = ApiResponseMeta(404, "1.1", HttpHeaders(), 0.0, NodeConfig("http", "localhost", 9200))
+    return NotFoundError("search_context_missing_exception", meta, {"error": {"type": "search_context_missing_exception"}})
+
+
+class ExpiredPitES:
+    def options(self, **kwargs):
+        return self
+
+    async def search(self, body):
+        raise expired_pit_error()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    user = SimpleNamespace(id=1, is_verified=True, searches_remaining=10)
+    app = FastAPI()
+    app.state.limiter = search.limiter
+    app.include_router(search.router, prefix="/api")
+    app.dependency_overrides[get_current_user] = lambda: user
+    app.dependency_overrides[search.get_db] = lambda: None
+    return TestClient(app)
+
+
+def test_cursor_expires_with_the_point_in_time():
+    issued = time.time()
+    claims = jwt.get_unverified_claims(search.create_cursor({"uid": 1}))
+
+    keep_alive = elasticsearch_client.keep_alive_seconds(settings.SEARCH_PIT_KEEP_ALIVE)
+    assert abs(claims["exp"] - (issued + keep_alive)) <= 2
+
+
+def test_expired_point_in_time_is_reported_as_gone(monkeypatch, client):
+    monkeypatch.setattr(elasticsearch_client, "get_es", lambda: ExpiredPitES())
+    cursor = search.create_cursor({
+        "uid": 1, "q": "someone", "type": "username", "page": 1, "pit": "pit-id", "after": [1.0, 5], "exact": False,
+    })
+
+    response = client.get("/api/search/username/page", params={"cursor": cursor})
+
+    assert response.status_code == 410
+    assert response.json()["detail"] == search.CURSOR_EXPIRED
+
+
+def test_expired_cursor_is_reported_as_gone(client):
+    cursor = jwt.encode(
+        {"uid": 1, "type": "username", "exp": 0, "aud": search.CURSOR_AUDIENCE, "typ": search.CURSOR_TYPE},
+        search.cursor_key(),
+        algorithm=search.CURSOR_ALGORITHM
+    )
+
+    response = client.get("/api/search/username/page", params={"cursor": cursor})
+
+    assert response.status_code == 410
+
+
+def test_cursors_and_access_tokens_are_not_interchangeable(client):
+    # An access token carries the claims a cursor needs, but is signed for authentication
+    token = create_access_token({"sub": "1", "uid": 1, "q": "someone", "type": "username", "page": 1})
+
+    response = client.get("/api/search/username/page", params={"cursor": token})
+
+    assert response.status_code == 400
+    assert verify_token(search.create_cursor({"uid": 1, "sub": "1"})) is None
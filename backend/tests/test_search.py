@@ -0,0 +1,91 @@
+import asyncio
+import json
+
+import pytest
+
+from app import search
+from app.database import SessionLocal, init_db
+from app.models import User
+from app.search_cache import search_cache
+
+
+@pytest.fixture
+def user_id(tmp_path):
+    init_db()
+    db = SessionLocal()
+    user = User(email=f"{tmp_path.name}@example.com", is_verified=True, searches_remaining=3)
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+    return user_id
+
+
+def searches_remaining(user_id: int) -> int:
+    db = SessionLocal()
+    try:
+        return db.get(User, user_id).searches_remaining
+    finally:
+        db.close()
+
+
+def stream(q: str, user_id: int) -> list:
+    async def collect():
+        response = search.stream_search(q, None, user_id)
+        return [json.loads(line) async for line in response.body_iterator]
+
+    return asyncio.run(collect())
+
+
+def test_failed_stream_is_not_charged(monkeypatch, user_id):
+    async def failing_search(q, type=None, tiers=None, fuzzy=False):
+        raise RuntimeError("cluster unavailable")
+
+    monkeypatch.setattr(search, "run_search", failing_search)
+
+    records = stream("failing stream", user_id)
+
+    assert records[-1]["event"] == "error"
+    assert searches_remaining(user_id) == 3
+
+
+def test_stream_runs_the_search_query_and_shares_its_cache_entry(monkeypatch, user_id):
+    calls = []
+
+    async def single_search(q, type=None, tiers=None, fuzzy=False):
+        calls.append(type)
+        return {"email": {"count": 2, "results": []}, "phone": {"count": 1, "results": []}}
+
+    monkeypatch.setattr(search, "run_search", single_search)
+
+    records = stream("cached stream", user_id)
+    # Served from the entry the first stream cached, as /search would be
+    again = stream("cached stream", user_id)
+
+    assert calls == [None]
+    assert records[-1]["event"] == "summary"
+    assert records[-1]["total_results"] == 3
+    assert again[-1]["total_results"] == 3
+    assert searches_remaining(user_id) == 1
+    assert search_cache.get("cached stream", None)["phone"]["count"] == 1
+
+
+def test_batch_charges_only_the_searches_that_succeeded(monkeypatch, user_id):
+    async def partly_failing_msearch(queries, per_type=10, fuzzy=False):
+        return [{"email": {"count": 1, "results": []}}, RuntimeError("shard failure")]
+
+    monkeypatch.setattr(search, "msearch_data", partly_failing_msearch)
+    data = search.BatchSearchRequest(queries=[
+        search.SearchQuery(query="batch one", type="email"),
+        search.SearchQuery(query="batch two", type="email"),
+    ])
+    db = SessionLocal()
+    try:
+        user = db.get(User, user_id)
+        response = asyncio.run(search.search_batch.__wrapped__(None, data, user, db))
+    finally:
+        db.close()
+
+    assert response["results"][0]["total_results"] == 1
+    assert "error" in response["results"][1]
+    assert searches_remaining(user_id) == 2
@@ -51,7 +51,7 @@ const AdminPanel = () => {
           <div className="cyber-border p-6 bg-cyber-dark-gray">
             <h3 className="text-xl font-bold text-cyber-orange mb-4">Data Management</h3>
             <p className="text-cyber-gray mb-4">Upload Excel/CSV files or bulk JSON imports</p>
-            <input type="file" accept=".xlsx,.xls,.csv" onChange={(e) => setFile(e.target.files?.[0] || null)} className="mb-3" />
+            <input type="file" accept=".xlsx,.xls,.csv,.gz,.zst,.ndjson,.jsonl,.json,.parquet,.arrow,.feather" onChange={(e) => setFile(e.target.files?.[0] || null)} className="mb-3" />
             <button className="btn-cyber" onClick={startUpload} disabled={!file || uploading}>
               {uploading ? 'UPLOADING...' : 'UPLOAD DATA'}
             </button>